@@ -0,0 +1,89 @@
+## Controlo de admissão do servidor RPC: orçamento global de CPU e filas por prioridade
+import asyncio
+import contextlib
+from collections import deque
+
+PRIORIDADES = ("leve", "pesada")  # por ordem de prioridade
+
+
+class ServidorOcupado(Exception):
+    """O servidor não tem capacidade para aceitar mais trabalho (fila cheia ou limite atingido)."""
+
+
+class ControloAdmissao:
+    """
+    Distribui um número fixo de slots de CPU pelos pedidos. Um pedido que não caiba nos slots livres
+    espera na fila da sua classe; as filas "leve" são sempre servidas antes das "pesada".
+    Se a fila da classe estiver cheia, o pedido é recusado logo com ServidorOcupado.
+    """
+
+    def __init__(self, slots: int, max_fila: dict):
+        self.slots = slots
+        self.livres = slots
+        self.max_fila = max_fila
+        self._filas = {classe: deque() for classe in PRIORIDADES}
+
+    @contextlib.asynccontextmanager
+    async def reservar(self, classe: str, custo: int = 1):
+        """Reserva custo slots (no máximo todos) durante o bloco, esperando pela vez se for preciso."""
+        custo = await self.adquirir(classe, custo)
+        try:
+            yield
+        finally:
+            self.libertar(custo)
+
+    async def adquirir(self, classe: str, custo: int = 1) -> int:
+        """
+        Reserva custo slots (no máximo todos), esperando pela vez se for preciso, e devolve quantos
+        ficaram reservados. Para quando os slots não são devolvidos no fim de um bloco: cabe ao
+        chamador devolvê-los com libertar.
+        """
+        custo = max(0, min(custo, self.slots))
+        await self._adquirir(classe, custo)
+        return custo
+
+    def libertar(self, custo: int):
+        """Devolve slots reservados com adquirir e passa-os aos pedidos que estão à espera."""
+        self.livres += custo
+        self._despachar()
+
+    async def _adquirir(self, classe: str, custo: int):
+        prioritarias = PRIORIDADES[:PRIORIDADES.index(classe) + 1]
+        if self.livres >= custo and not any(self._filas[c] for c in prioritarias):
+            self.livres -= custo
+            return
+
+        fila = self._filas[classe]
+        if len(fila) >= self.max_fila[classe]:
+            raise ServidorOcupado(f"fila '{classe}' cheia")
+        entrada = (custo, asyncio.get_running_loop().create_future())
+        fila.append(entrada)
+        try:
+            await entrada[1]
+        except asyncio.CancelledError:
+            if entrada[1].done() and not entrada[1].cancelled():
+                # Os slots já tinham sido atribuídos a este pedido: devolve-os
+                self.livres += custo
+                self._despachar()
+            elif entrada in fila:
+                fila.remove(entrada)
+            raise
+
+    def _despachar(self):
+        for classe in PRIORIDADES:
+            fila = self._filas[classe]
+            while fila and (fila[0][1].cancelled() or fila[0][0] <= self.livres):
+                custo, futuro = fila.popleft()
+                if futuro.cancelled():
+                    continue
+                self.livres -= custo
+                futuro.set_result(None)
+            if fila:
+                return  # o primeiro da fila ainda não cabe: as classes seguintes não lhe passam à frente
+
+    def estatisticas(self) -> dict:
+        return {
+            "slots": self.slots,
+            "slots_in_use": self.slots - self.livres,
+            "queued": {classe: len(fila) for classe, fila in self._filas.items()},
+        }
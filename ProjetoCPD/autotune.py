@@ -0,0 +1,161 @@
+## Autotuning do número de workers e do tamanho dos blocos, com a calibração guardada em cache por máquina.
+## A calibração só é medida por `python autotune.py`; as funções de cálculo limitam-se a ler a que existir.
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from multiprocessing import Array, Lock, Process, Value
+from typing import Optional
+
+import divisao
+import tabela_primos
+
+# Ficheiro onde fica a calibração de cada máquina (pode ser mudado com a variável de ambiente)
+FICHEIRO_CACHE = os.environ.get("PROJETOCPD_AUTOTUNE",
+                                os.path.join(os.path.expanduser("~"), ".cache", "projetocpd_autotune.json"))
+DURACAO_MEDICAO = 0.5  # segundos de medição por configuração
+# Tamanhos de bloco (divisores por bloco) experimentados para o crack_key, à volta do valor fixo anterior
+BLOCOS_CANDIDATOS = tuple(divisao.RODA * divisao.TAMANHO_BLOCO // 8 * f // 16 for f in (1, 4, 16, 64))
+TOLERANCIA = 0.05  # entre opções a menos de 5% da melhor (ruído da medição), escolhe-se a mais pequena
+# Semiprimo acima de 2^63 (caminho multi-limb) para medir o kernel como num crack_key real
+_N_MEDICAO = (2**31 - 1) * (2**61 - 1)
+
+_lock = threading.Lock()
+_calibracao = None  # calibração desta máquina já carregada neste processo
+
+
+def chave_maquina() -> str:
+    return f"{socket.gethostname()}/{os.cpu_count() or 1}"
+
+
+def _candidatos_workers():
+    cpus = os.cpu_count() or 1
+    return sorted({1, 2, 4, max(1, cpus // 2), cpus, 2 * cpus})
+
+
+def _medir_workers(n_workers: int, duracao: float) -> dict:
+    """Arranque (até todos os workers estarem a testar) e débito agregado (candidatos/s) do find_max_prime_parallel."""
+    import calculo  # aqui e não no topo: o calculo importa este módulo
+    contagens = Array('Q', n_workers, lock=False)
+    stop_event = multiprocessing.Event()
+    shared_max = Value('Q', 2)
+    lock = Lock()
+    descritor = tabela_primos.obter_tabela().descritor
+    t0 = time.perf_counter()
+    processos = [Process(target=calculo.worker_static,
+                         args=(10**15 + 1 + 2 * i, 2 * n_workers, duracao + 30, shared_max, lock, stop_event,
+                               contagens, i, descritor))
+                 for i in range(n_workers)]
+    for p in processos:
+        p.start()
+    try:
+        while not all(contagens) and time.perf_counter() - t0 < 30:
+            time.sleep(0.005)
+        arranque = time.perf_counter() - t0
+        c0, t1 = sum(contagens), time.perf_counter()
+        time.sleep(duracao)
+        debito = (sum(contagens) - c0) / (time.perf_counter() - t1)
+    finally:
+        stop_event.set()
+        for p in processos:
+            p.join()
+    return {"startup": arranque, "rate": debito}
+
+
+def _medir_bloco(tamanho: int, duracao: float) -> float:
+    """Divisores testados por segundo pelo kernel do crack_key com blocos deste tamanho."""
+    inicio = 7
+    testados = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < duracao:
+        divisao.menor_divisor(_N_MEDICAO, inicio, inicio + tamanho)
+        inicio += tamanho
+        testados += tamanho
+    return testados / (time.perf_counter() - t0)
+
+
+def calibrar(duracao: float = DURACAO_MEDICAO) -> dict:
+    """Mede esta máquina (alguns segundos) e devolve a calibração, sem a guardar."""
+    workers = {str(n): _medir_workers(n, duracao) for n in _candidatos_workers()}
+    debitos = {tamanho: _medir_bloco(tamanho, duracao) for tamanho in BLOCOS_CANDIDATOS}
+    melhor = max(debitos.values())
+    bloco = min(t for t, d in debitos.items() if d >= (1 - TOLERANCIA) * melhor)
+    return {"workers": workers, "block": bloco, "calibrated": time.time()}
+
+
+def _ler_ficheiro() -> dict:
+    try:
+        with open(FICHEIRO_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar(calibracao: dict):
+    todas = _ler_ficheiro()
+    todas[chave_maquina()] = calibracao
+    os.makedirs(os.path.dirname(os.path.abspath(FICHEIRO_CACHE)), exist_ok=True)
+    temporario = FICHEIRO_CACHE + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(todas, f, indent=2)
+    os.replace(temporario, FICHEIRO_CACHE)
+
+
+def calibracao_existente() -> Optional[dict]:
+    """Calibração desta máquina já feita (em memória ou no ficheiro de cache), sem nunca medir; None se não houver."""
+    global _calibracao
+    with _lock:
+        if _calibracao is None:
+            _calibracao = _ler_ficheiro().get(chave_maquina())
+        return _calibracao
+
+
+def obter_calibracao(recalibrar: bool = False) -> dict:
+    """Calibração desta máquina: em memória, senão no ficheiro de cache, senão mede agora (e guarda)."""
+    global _calibracao
+    with _lock:
+        if _calibracao is None and not recalibrar:
+            _calibracao = _ler_ficheiro().get(chave_maquina())
+        if _calibracao is None or recalibrar:
+            _calibracao = calibrar()
+            _guardar(_calibracao)
+        return _calibracao
+
+
+def _escolher_workers(workers: dict, timeout: float) -> int:
+    # Trabalho esperado = débito x tempo que sobra depois do arranque (com timeout infinito, só o débito)
+    if math.isinf(timeout):
+        trabalho = {int(n): m["rate"] for n, m in workers.items()}
+    else:
+        trabalho = {int(n): m["rate"] * max(timeout - m["startup"], 0.0) for n, m in workers.items()}
+    melhor = max(trabalho.values())
+    return min(n for n, t in trabalho.items() if t >= (1 - TOLERANCIA) * melhor)
+
+
+def melhor_n_workers(timeout: Optional[float] = None) -> int:
+    """
+    Número de workers que testa mais candidatos em timeout segundos (None: sem limite), segundo a
+    calibração desta máquina; sem calibração, o número de CPUs. Nunca mede nada (pode ser chamada
+    dentro de um pedido ou pelo servidor para reservar slots).
+    """
+    calibracao = calibracao_existente()
+    if calibracao is None:
+        return os.cpu_count() or 1
+    return _escolher_workers(calibracao["workers"], timeout if timeout is not None else math.inf)
+
+
+def melhor_tamanho_bloco() -> Optional[int]:
+    """Divisores por bloco para os workers do crack_key segundo a calibração, ou None se ainda não houver."""
+    calibracao = calibracao_existente()
+    return calibracao["block"] if calibracao is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibra o número de workers e o tamanho dos blocos nesta máquina")
+    parser.add_argument("--force", action="store_true", help="repete a calibração mesmo que já exista")
+    args = parser.parse_args()
+    print(json.dumps({chave_maquina(): obter_calibracao(recalibrar=args.force)}, indent=2))
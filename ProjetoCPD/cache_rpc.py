@@ -0,0 +1,78 @@
+## Cache de resultados para os métodos puros do servidor RPC
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+import protocolo_binario
+
+
+class CacheResultados:
+    """
+    Cache LRU de resultados, com TTL opcional por entrada e limites de número de entradas
+    e de memória (tamanho aproximado do resultado serializado no protocolo binário, que, ao contrário
+    do JSON, não converte os inteiros para texto e aceita inteiros de qualquer tamanho).
+    """
+
+    def __init__(self, max_entradas: int = 10_000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas: "OrderedDict[Hashable, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def obter(self, chave: Hashable) -> Tuple[bool, Any]:
+        """Devolve (True, resultado) se a chave estiver em cache e não tiver expirado, senão (False, None)."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                resultado, expira, _ = entrada
+                if expira is None or time.monotonic() < expira:
+                    self._entradas.move_to_end(chave)
+                    self.hits += 1
+                    return True, resultado
+                self._remover(chave)
+            self.misses += 1
+            return False, None
+
+    def guardar(self, chave: Hashable, resultado: Any, ttl: Optional[float] = None):
+        """Guarda um resultado; resultados maiores do que o limite de memória não são guardados."""
+        try:
+            tamanho = len(protocolo_binario.codificar(resultado))
+        except TypeError:
+            return  # tipo que não se sabe medir: não fica em cache
+        if tamanho > self.max_bytes:
+            return
+        expira = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (resultado, expira, tamanho)
+            self._bytes += tamanho
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._remover(next(iter(self._entradas)))
+                self.evictions += 1
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            pedidos = self.hits + self.misses
+            return {
+                "entries": len(self._entradas),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / pedidos if pedidos else 0.0,
+            }
+
+    def _remover(self, chave: Hashable):
+        _, _, tamanho = self._entradas.pop(chave)
+        self._bytes -= tamanho
@@ -2,12 +2,22 @@
 import multiprocessing
 import math
 import time
-from multiprocessing import Queue, Value, Lock, Process
+from multiprocessing import Queue
 from queue import Empty
 import random
+import threading
+from array import array
 
-from typing import Optional, Tuple, List
+import autotune
+import divisao
+import execucao
+import tabela_primos
 
+from typing import Callable, Iterator, Optional, Tuple, List
+
+INTERVALO_PROGRESSO = 0.5  # segundos entre notificações de progresso (parâmetro progress)
+LIMITE_SPF = 1 << 22       # até aqui, a fatorização em lote usa uma tabela completa de menores fatores primos (16 MB)
+TAMANHO_SEGMENTO = 1 << 18  # números por segmento do crivo acima de LIMITE_SPF
 
 
 def is_prime(n: int) -> bool:
@@ -30,18 +40,37 @@ def is_prime(n: int) -> bool:
     return True
 
 
+def _is_prime_tabela(n: int, tabela: tabela_primos.TabelaPrimos) -> bool:
+    """Como is_prime, mas só divide pelos primos da tabela partilhada (n tem de estar coberto pela tabela)."""
+    if n <= 1:
+        return False
+    for p in divisao.PRIMOS_RODA:
+        if n % p == 0:
+            return n == p
+    return divisao.menor_divisor(n, 7, math.isqrt(n) + 1, tabela.primos) is None
 
-def find_max_prime_sequential(timeout: int,start_base:int =3) -> int:
+
+def find_max_prime_sequential(timeout: int,start_base:int =3, *, progress: Optional[Callable[[dict], None]] = None,
+                              cancel: Optional[threading.Event] = None) -> int:
     """Encontra o maior primo possível dentro do tempo limite (sequencialmente). (start_base é o nr a partir do qual começa a procurar(padrão=3)."""
     if not isinstance(timeout, int) or timeout < 0:
         raise ValueError("timeout deve ser um inteiro positivo.")
     start_time = time.time()
+    proximo_progresso = start_time + INTERVALO_PROGRESSO
     max_prime = 2
     n = start_base if start_base % 2 == 1 else start_base + 1
-    while time.time() - start_time < timeout:
+    testados = 0
+    while (agora := time.time()) - start_time < timeout:
         if is_prime(n):
             max_prime = n
         n += 2  # só testa ímpares
+        testados += 1
+        if agora >= proximo_progresso:
+            if cancel is not None and cancel.is_set():
+                break
+            if progress is not None:
+                progress({"best": max_prime, "scanned": testados, "elapsed": agora - start_time})
+            proximo_progresso = agora + INTERVALO_PROGRESSO
     return max_prime
 
 def _candidate_generator(queue: Queue, stop_event: multiprocessing.Event, base: int = 10_000_001):
@@ -50,39 +79,68 @@ def _candidate_generator(queue: Queue, stop_event: multiprocessing.Event, base:
         queue.put(n)
         n += 2
 
-def worker_static(start: int, step: int, timeout: float, shared_max: Value, lock: Lock, stop_event: multiprocessing.Event):
+def worker_static(start: int, step: int, timeout: float, shared_max, lock, stop_event,
+                  contagens=None, indice: int = 0, tabela=None):
+    # shared_max, lock, stop_event e contagens vêm do backend de execução (multiprocessing ou threading)
     t0 = time.time()
+    tabela = tabela_primos.anexar_tabela(tabela)
     n = start
+    testados = 0
     while not stop_event.is_set() and time.time() - t0 < timeout:
-        if is_prime(n):
+        if _is_prime_tabela(n, tabela) if tabela is not None and tabela.cobre(n) else is_prime(n):
             with lock:
                 if n > shared_max.value:
                     shared_max.value = n
         n += step
+        if contagens is not None:
+            testados += 1
+            contagens[indice] = testados
 
 
-def find_max_prime_parallel(timeout: int, n_workers: int = 4) -> int:
-    """ Encontra o maior número primo possível dentro do tempo limite, utilizando múltiplos processos em paralelo."""
+def find_max_prime_parallel(timeout: int, n_workers: Optional[int] = 4, *, progress: Optional[Callable[[dict], None]] = None,
+                            cancel: Optional[threading.Event] = None, backend: Optional[str] = None) -> int:
+    """ Encontra o maior número primo possível dentro do tempo limite, utilizando múltiplos processos em paralelo.
+    Com n_workers=None, usa o número de workers calibrado para esta máquina e este timeout
+    (python autotune.py; sem calibração, um worker por CPU).
+    backend ("process" ou "thread") escolhe onde correm os workers; por omissão, threads num CPython sem GIL."""
     if not isinstance(timeout, int) or timeout < 0:
         raise ValueError("timeout deve ser um inteiro positivo.")
+    if n_workers is None:
+        n_workers = autotune.melhor_n_workers(timeout)
     if not isinstance(n_workers, int) or n_workers < 1:
         raise ValueError("n_workers deve ser um inteiro positivo.")
+    execucao_workers = execucao.obter_backend(backend)
 
-    shared_max = Value('Q', 2)  # 'Q' para unsigned long long (8 bytes)
-    lock = Lock()
-    stop_event = multiprocessing.Event()
+    shared_max = execucao_workers.valor('Q', 2)  # 'Q' para unsigned long long (8 bytes)
+    lock = execucao_workers.lock()
+    stop_event = execucao_workers.evento()
+    contagens = execucao_workers.vetor('Q', n_workers) if progress is not None else None
 
     processes = []
     base_start = 10**15 + 1  # ~15 dígitos e ímpar
+    # Tabela de primos construída uma vez e partilhada (sem cópias) por todos os workers
+    tabela = tabela_primos.obter_tabela()
 
     for i in range(n_workers):
         start = base_start + i * 2  # começa em ímpares diferentes
         step = n_workers * 2
-        p = Process(target=worker_static, args=(start, step, timeout, shared_max, lock, stop_event))
-        p.start()
+        p = execucao_workers.iniciar(worker_static, (start, step, timeout, shared_max, lock, stop_event, contagens, i,
+                                                     tabela.descritor))
         processes.append(p)
 
-    time.sleep(timeout)
+    if progress is None and cancel is None:
+        time.sleep(timeout)
+    else:
+        # Acorda a intervalos curtos para reportar progresso e parar os workers se for cancelado
+        t0 = time.time()
+        proximo_progresso = t0 + INTERVALO_PROGRESSO
+        while (restante := timeout - (time.time() - t0)) > 0:
+            if cancel is not None and cancel.is_set():
+                break
+            time.sleep(min(restante, 0.1))
+            if progress is not None and (time.time() >= proximo_progresso or time.time() - t0 >= timeout):
+                progress({"best": shared_max.value, "scanned": sum(contagens), "elapsed": time.time() - t0})
+                proximo_progresso = time.time() + INTERVALO_PROGRESSO
     stop_event.set()
 
     for p in processes:
@@ -91,6 +149,26 @@ def find_max_prime_parallel(timeout: int, n_workers: int = 4) -> int:
     return shared_max.value
 
 
+def largest_prime_in_range(lo: int, hi: int, timeout: float = 10) -> Optional[int]:
+    """Devolve o maior primo p com lo <= p < hi, ou None se não houver. Lança TimeoutError se não terminar a tempo."""
+    if not isinstance(lo, int) or not isinstance(hi, int):
+        raise TypeError("lo e hi devem ser inteiros.")
+    if not isinstance(timeout, (int, float)) or timeout < 0:
+        raise ValueError("timeout deve ser um número positivo.")
+    limite = time.time() + timeout
+    tabela = tabela_primos.tabela_atual()
+    n = hi - 1
+    if n > 2 and n % 2 == 0:
+        n -= 1
+    while n >= max(lo, 2):
+        if _is_prime_tabela(n, tabela) if tabela is not None and tabela.cobre(n) else is_prime(n):
+            return n
+        if time.time() >= limite:
+            raise TimeoutError(f"sem resultado para [{lo}, {hi}) dentro do tempo limite")
+        n -= 1 if n <= 3 else 2
+    return None
+
+
 
 
 
@@ -125,17 +203,7 @@ def prime_factors(n: int) -> List[int]:
         raise TypeError("n deve ser um inteiro.")
 
 
-    n = abs(n)  # Usa valor absoluto para lidar com negativos
-    factors = []
-    divisor = 2
-    while divisor * divisor <= n:
-        while n % divisor == 0:
-            factors.append(divisor)
-            n //= divisor
-        divisor += 1
-    if n > 1:
-        factors.append(n)
-    return factors
+    return divisao.fatores_primos(abs(n), tabela_primos.tabela_atual())  # Usa valor absoluto para lidar com negativos
 
 def next_prime(n: int) -> int:
     """Devolve o menor número primo estritamente maior do que n."""
@@ -161,6 +229,152 @@ def previous_prime(n: int) -> Optional[int]:
         candidate -= 1
     return None
 
+_spf = array('I')  # menor fator primo de cada n < len(_spf); 0 para os primos, 0 e 1
+
+
+def _tabela_spf(limite: int) -> array:
+    """Tabela (em cache neste processo) com o menor fator primo de cada n < limite."""
+    global _spf
+    if len(_spf) < limite:
+        limite = min(max(limite, 2 * len(_spf), 1 << 16), LIMITE_SPF)
+        spf = array('I', bytes(4 * limite))
+        # Do maior primo para o menor: cada número fica com o último (o menor) primo que o marcou
+        for p in reversed(tabela_primos.primos_ate(math.isqrt(limite - 1) + 1)):
+            p = int(p)
+            spf[p * p::p] = array('I', [p]) * len(range(p * p, limite, p))
+        _spf = spf
+    return _spf
+
+
+def _primos_base(hi: int):
+    """Primos até √hi para o crivo segmentado (calculados uma vez por intervalo), ou None se não forem precisos."""
+    return tabela_primos.primos_ate(math.isqrt(hi - 1) + 1) if hi > LIMITE_SPF else None
+
+
+def _fatorizar_segmento(lo: int, hi: int, fatores: array, offsets: array, primos):
+    """
+    Acrescenta a fatores/offsets (CSR) os fatores de cada n em [lo, hi), com lo >= 2 e hi > LIMITE_SPF.
+    primos tem de incluir todos os primos até √hi (pode ter mais: os primos base do intervalo inteiro).
+    """
+    # Crivo segmentado: cada n é dividido pelos primos base que o dividem, uma vez por cada
+    # potência p^k que divide n; o que sobra (> 1) é um único primo maior do que √hi.
+    tamanho = hi - lo
+    np = divisao.np
+    if np is not None and hi <= divisao.LIMITE_INT64:
+        resto = np.arange(lo, hi, dtype=np.int64)
+        posicoes, valores = [], []
+        for p in primos:
+            p = pk = int(p)
+            while pk < hi:
+                indices = np.arange((-lo) % pk, tamanho, pk)
+                if indices.size == 0:
+                    break
+                resto[indices] //= p
+                posicoes.append(indices)
+                valores.append(np.full(indices.size, p, dtype=np.int64))
+                pk *= p
+        grandes = np.flatnonzero(resto > 1)
+        posicoes.append(grandes)
+        valores.append(resto[grandes])
+        posicoes = np.concatenate(posicoes)
+        # A ordenação estável mantém os fatores de cada número por ordem crescente (ordem em que foram encontrados)
+        ordem = np.argsort(posicoes, kind="stable")
+        base = len(fatores)
+        fatores.frombytes(np.concatenate(valores)[ordem].astype(np.uint64).tobytes())
+        contagens = np.bincount(posicoes, minlength=tamanho)
+        offsets.frombytes((base + np.cumsum(contagens)).astype(np.uint64).tobytes())
+        return
+
+    resto = list(range(lo, hi))
+    listas = [[] for _ in range(tamanho)]
+    for p in primos:
+        p = pk = int(p)
+        while pk < hi:
+            for i in range((-lo) % pk, tamanho, pk):
+                resto[i] //= p
+                listas[i].append(p)
+            pk *= p
+    for r, lista in zip(resto, listas):
+        fatores.extend(lista)
+        if r > 1:
+            fatores.append(r)
+        offsets.append(len(fatores))
+
+
+def _fatorizar_intervalo(lo: int, hi: int, fatores: array, offsets: array, primos=None):
+    for _ in range(lo, min(hi, 2)):
+        offsets.append(len(fatores))  # 0 e 1 não têm fatores primos
+    lo = max(lo, 2)
+    if lo >= hi:
+        return
+    if hi > LIMITE_SPF:
+        _fatorizar_segmento(lo, hi, fatores, offsets, primos if primos is not None else _primos_base(hi))
+        return
+    spf = _tabela_spf(hi)
+    for n in range(lo, hi):
+        while n > 1:
+            p = spf[n] or n
+            fatores.append(p)
+            n //= p
+        offsets.append(len(fatores))
+
+
+def _validar_intervalo(lo: int, hi: int):
+    if not isinstance(lo, int) or not isinstance(hi, int):
+        raise TypeError("lo e hi devem ser inteiros.")
+    if lo < 0 or hi > divisao.LIMITE_INT64:
+        raise ValueError("o intervalo tem de estar entre 0 e 2^63.")
+
+
+def iter_prime_factors_range(lo: int, hi: int, tamanho_segmento: int = TAMANHO_SEGMENTO) -> Iterator[Tuple[int, List[int]]]:
+    """Gera (n, fatores primos de n) para cada n em [lo, hi), um segmento de cada vez (memória limitada)."""
+    _validar_intervalo(lo, hi)
+    primos = _primos_base(hi)
+    for inicio in range(lo, hi, tamanho_segmento):
+        fatores, offsets = array('Q'), array('Q', [0])
+        _fatorizar_intervalo(inicio, min(inicio + tamanho_segmento, hi), fatores, offsets, primos)
+        for i in range(len(offsets) - 1):
+            yield inicio + i, fatores[offsets[i]:offsets[i + 1]].tolist()
+
+
+def prime_factors_range(lo: int, hi: int) -> Tuple[array, array]:
+    """
+    Fatores primos de todos os inteiros em [lo, hi), em formato CSR: os fatores de lo + i são
+    fatores[offsets[i]:offsets[i + 1]], por ordem crescente. Muito mais rápido do que prime_factors
+    número a número: usa uma tabela de menores fatores primos (ou um crivo segmentado para valores altos).
+    """
+    _validar_intervalo(lo, hi)
+    fatores, offsets = array('Q'), array('Q', [0])
+    primos = _primos_base(hi)
+    for inicio in range(lo, hi, TAMANHO_SEGMENTO):
+        _fatorizar_intervalo(inicio, min(inicio + TAMANHO_SEGMENTO, hi), fatores, offsets, primos)
+    return fatores, offsets
+
+
+def prime_factors_many(values: List[int]) -> Tuple[array, array]:
+    """Fatores primos de cada valor (como prime_factors), em formato CSR como prime_factors_range. Valores até 2^64."""
+    valores = []
+    for v in values:
+        if not isinstance(v, int):
+            raise TypeError("os valores devem ser inteiros.")
+        if abs(v) >= 1 << 64:
+            raise ValueError("os valores devem ser menores do que 2^64 em valor absoluto.")
+        valores.append(abs(v))
+    spf = _tabela_spf(min(max(valores, default=0) + 1, LIMITE_SPF))
+    tabela = tabela_primos.tabela_atual()
+    fatores, offsets = array('Q'), array('Q', [0])
+    for n in valores:
+        if n < len(spf):
+            while n > 1:
+                p = spf[n] or n
+                fatores.append(p)
+                n //= p
+        else:
+            fatores.extend(divisao.fatores_primos(n, tabela))
+        offsets.append(len(fatores))
+    return fatores, offsets
+
+
 """"""""""""""""""""""""""""""""
 
 if __name__ == "__main__":
@@ -1,12 +1,63 @@
 import asyncio
+import contextlib
+import time
 import websockets
 import json
 import ast
+import protocolo_binario
+from websockets.protocol import State
 
 class RPCClientWS:
-    def __init__(self, uri="ws://localhost:8000"):
+    INATIVIDADE_VERIFICACAO = 5.0  # segundos sem tráfego a partir dos quais a ligação é testada com um ping
+    TEMPO_PING = 2.0               # segundos à espera do pong antes de dar a ligação como morta
+
+    def __init__(self, uri="ws://localhost:8000", binario=True, tentativas_ligacao=3, on_notification=None,
+                 max_em_curso=32):
+        """
+        Cliente com uma única ligação persistente: várias chamadas a invoke podem estar em curso ao mesmo
+        tempo e as respostas são encaminhadas pelo id. A ligação é aberta na primeira chamada e reaberta
+        automaticamente se cair (até tentativas_ligacao tentativas por chamada); as chamadas em curso
+        quando a ligação cai falham com ConnectionError, porque não se sabe se o servidor as executou.
+        Uma ligação parada há algum tempo é testada com um ping antes de ser reutilizada: o servidor pode
+        tê-la fechado entretanto (ex: o cliente esteve bloqueado e não respondeu aos pings do servidor).
+        No máximo max_em_curso chamadas esperam resposta ao mesmo tempo (o servidor recusa as que passem
+        do seu limite por ligação); as restantes aguardam a vez no cliente.
+
+        Com binario=True propõe ao servidor o protocolo binário compacto (inteiros grandes sem
+        conversão para texto); se o servidor não o aceitar, a ligação continua em JSON.
+        on_notification(method, params) recebe as notificações do servidor que não são de progresso
+        (ex: "job_finished" depois de um subscribe).
+        """
         self.uri = uri
+        self.binario = binario
+        self.tentativas_ligacao = tentativas_ligacao
+        self.on_notification = on_notification
+        self.max_em_curso = max_em_curso
         self._next_id = 1
+        self._websocket = None
+        self._leitor = None
+        self._loop = None
+        self._lock_ligacao = None
+        self._em_curso = None
+        self._pendentes = {}   # id -> (ligação onde o pedido foi enviado, Future da resposta)
+        self._progresso = {}   # id -> callback on_progress
+        self._tarefas = set()  # envios de $/cancelRequest e fechos de ligações mortas ainda em curso
+        self._ultima_atividade = 0.0
+
+    def _subprotocolos(self):
+        return [protocolo_binario.SUBPROTOCOLO] if self.binario else None
+
+    @staticmethod
+    def _serializar(websocket, mensagem):
+        if websocket.subprotocol == protocolo_binario.SUBPROTOCOLO:
+            return protocolo_binario.codificar(mensagem)
+        return json.dumps(mensagem)
+
+    @staticmethod
+    def _descodificar(websocket, mensagem):
+        if websocket.subprotocol == protocolo_binario.SUBPROTOCOLO:
+            return protocolo_binario.descodificar(mensagem)
+        return json.loads(mensagem)
 
     def _get_id(self):
         # gera ids únicos para cada chamada
@@ -14,7 +65,137 @@ class RPCClientWS:
         self._next_id += 1
         return id_
 
-    async def invoke(self, method, params=None):
+    def _preparar_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Primeira utilização, ou o cliente passou para outro event loop (ex: novo asyncio.run):
+            # a ligação antiga pertence ao loop anterior e não pode ser reutilizada
+            self._loop = loop
+            self._websocket = None
+            self._leitor = None
+            self._lock_ligacao = asyncio.Lock()
+            self._em_curso = asyncio.Semaphore(self.max_em_curso)
+            self._pendentes.clear()
+            self._progresso.clear()
+
+    async def _ligar(self):
+        """Devolve a ligação aberta, abrindo uma nova (com novas tentativas) se ainda não houver."""
+        self._preparar_loop()
+        async with self._lock_ligacao:
+            if self._websocket is not None and self._leitor is not None and not self._leitor.done():
+                if (time.monotonic() - self._ultima_atividade < self.INATIVIDADE_VERIFICACAO
+                        or await self._responde(self._websocket)):
+                    return self._websocket
+                self._descartar(self._websocket)
+            for tentativa in range(self.tentativas_ligacao):
+                try:
+                    websocket = await websockets.connect(self.uri, subprotocols=self._subprotocolos())
+                    break
+                except OSError:
+                    if tentativa == self.tentativas_ligacao - 1:
+                        raise
+                    await asyncio.sleep(0.1 * 2 ** tentativa)
+            self._websocket = websocket
+            self._leitor = asyncio.ensure_future(self._ler(websocket))
+            self._ultima_atividade = time.monotonic()
+            return websocket
+
+    async def _responde(self, websocket):
+        """Testa a ligação com um ping: False se já estiver fechada ou o pong não chegar a tempo."""
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self.TEMPO_PING)
+        except (websockets.ConnectionClosed, asyncio.TimeoutError):
+            return False
+        self._ultima_atividade = time.monotonic()
+        return True
+
+    def _descartar(self, websocket):
+        """Deixa de usar a ligação e fecha-a em segundo plano (os pedidos nela pendentes falham)."""
+        if self._websocket is websocket:
+            self._websocket = None
+        self._lancar(websocket.close())
+
+    def _lancar(self, corrotina):
+        tarefa = asyncio.ensure_future(corrotina)
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _ler(self, websocket):
+        """Lê todas as mensagens da ligação e entrega cada resposta à chamada que a espera."""
+        try:
+            async for mensagem in websocket:
+                self._ultima_atividade = time.monotonic()
+                try:
+                    dados = self._descodificar(websocket, mensagem)
+                except ValueError:
+                    continue
+                for resposta in dados if isinstance(dados, list) else [dados]:
+                    self._encaminhar(resposta)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self._websocket is websocket:
+                self._websocket = None
+            # Só os pedidos enviados nesta ligação: os outros já foram (re)enviados numa ligação nova
+            for id_, (ligacao, futuro) in list(self._pendentes.items()):
+                if ligacao is not websocket:
+                    continue
+                del self._pendentes[id_]
+                self._progresso.pop(id_, None)
+                if not futuro.done():
+                    futuro.set_exception(ConnectionError("ligação ao servidor perdida"))
+
+    def _encaminhar(self, resposta):
+        if not isinstance(resposta, dict):
+            return
+        if "method" in resposta:
+            params = resposta.get("params") or {}
+            if resposta["method"] == "progress":
+                callback = self._progresso.get(params.get("id"))
+                if callback is not None:
+                    callback(params)
+            elif self.on_notification is not None:
+                self.on_notification(resposta["method"], params)
+            return
+        _, futuro = self._pendentes.pop(resposta.get("id"), (None, None))
+        if futuro is not None and not futuro.done():
+            futuro.set_result(resposta)
+
+    async def _enviar(self, mensagem, ids):
+        """
+        Envia mensagem (um pedido ou um batch) e regista as respostas esperadas para os ids; devolve
+        (ligação, [Future da resposta de cada id]). Uma ligação que já esteja fechada antes de o pedido
+        ser escrito é trocada por outra e o pedido vai nessa; se cair depois de ele ser enviado,
+        dá ConnectionError, porque não se sabe se o servidor o executou.
+        """
+        for _ in range(self.tentativas_ligacao):
+            websocket = await self._ligar()
+            if websocket.state is State.OPEN:
+                break
+            self._descartar(websocket)
+        else:
+            raise ConnectionError("ligação ao servidor perdida")
+        loop = asyncio.get_running_loop()
+        futuros = []
+        for id_ in ids:
+            futuro = loop.create_future()
+            self._pendentes[id_] = (websocket, futuro)
+            futuros.append(futuro)
+        try:
+            await websocket.send(self._serializar(websocket, mensagem))
+        except websockets.ConnectionClosed as e:
+            for id_ in ids:
+                self._pendentes.pop(id_, None)
+            raise ConnectionError("ligação ao servidor perdida") from e
+        self._ultima_atividade = time.monotonic()
+        return websocket, futuros
+
+    async def invoke(self, method, params=None, on_progress=None):
+        """
+        Invoca method no servidor. Se on_progress for indicado, pede ao servidor notificações
+        de progresso ("stream": true) e chama on_progress(dados) para cada uma até chegar o resultado.
+        """
         id_ = self._get_id()
         pedido = {
             "jsonrpc": "2.0",
@@ -23,24 +204,112 @@ class RPCClientWS:
         }
         if params is not None:
             pedido["params"] = params
+        if on_progress is not None:
+            pedido["stream"] = True
+
+        self._preparar_loop()
+        async with self._em_curso:
+            if on_progress is not None:
+                self._progresso[id_] = on_progress
+            try:
+                websocket, (futuro,) = await self._enviar(pedido, [id_])
+                try:
+                    resposta_json = await futuro
+                except asyncio.CancelledError:
+                    self._cancelar_no_servidor(websocket, id_)
+                    raise
+            finally:
+                self._pendentes.pop(id_, None)
+                self._progresso.pop(id_, None)
+        return self._resultado(resposta_json)
 
-        async with websockets.connect(self.uri) as websocket:
-            await websocket.send(json.dumps(pedido))
-            resposta = await websocket.recv()
-            resposta_json = json.loads(resposta)
+    def _cancelar_no_servidor(self, websocket, id_):
+        """
+        Pede ao servidor que pare o pedido id_, cuja resposta já ninguém espera (ex: o cliente deixou de
+        ouvir o progresso a meio). Vai como notificação $/cancelRequest, sem esperar pela resposta.
+        """
+        aviso = {"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": id_}}
 
-            # Validação básica da resposta
-            if resposta_json.get("id") != id_:
-                raise Exception("ID da resposta não coincide com o pedido")
+        async def enviar():
+            with contextlib.suppress(websockets.ConnectionClosed):
+                await websocket.send(self._serializar(websocket, aviso))
 
-            if "result" in resposta_json:
-                return resposta_json["result"]
-            elif "error" in resposta_json:
-                raise Exception(f"Erro remoto: {resposta_json['error']}")
-            else:
-                raise Exception("Resposta inválida do servidor.")
+        self._lancar(enviar())
+
+    @staticmethod
+    def _resultado(resposta_json):
+        if "result" in resposta_json:
+            return resposta_json["result"]
+        elif "error" in resposta_json:
+            raise Exception(f"Erro remoto: {resposta_json['error']}")
+        else:
+            raise Exception("Resposta inválida do servidor.")
+
+    async def invoke_many(self, chamadas, max_batch=100, max_batches_em_curso=2):
+        """
+        Invoca várias chamadas [(method, params), ...] usando batches JSON-RPC de até max_batch pedidos,
+        com até max_batches_em_curso batches enviados sem esperar pelas respostas dos anteriores.
+        Devolve uma lista pela ordem das chamadas, com o resultado de cada uma ou a exceção com que falhou
+        (não lança exceções por chamadas individuais). O servidor corre até 16 pedidos de cada batch
+        em simultâneo, por isso o valor por omissão de max_batches_em_curso fica dentro do seu limite por ligação.
+        """
+        chamadas = list(chamadas)
+        self._preparar_loop()
+        limite = asyncio.Semaphore(max_batches_em_curso)
+
+        async def enviar_batch(parte):
+            async with limite, self._em_curso:
+                pedidos = []
+                for method, params in parte:
+                    pedido = {"jsonrpc": "2.0", "method": method, "id": self._get_id()}
+                    if params is not None:
+                        pedido["params"] = params
+                    pedidos.append(pedido)
+                try:
+                    _, futuros = await self._enviar(pedidos, [pedido["id"] for pedido in pedidos])
+                    respostas = await asyncio.gather(*futuros, return_exceptions=True)
+                except ConnectionError as e:
+                    respostas = [e] * len(parte)
+                finally:
+                    for pedido in pedidos:
+                        self._pendentes.pop(pedido["id"], None)
+
+            resultados = []
+            for resposta in respostas:
+                if isinstance(resposta, BaseException):
+                    resultados.append(resposta)
+                    continue
+                try:
+                    resultados.append(self._resultado(resposta))
+                except Exception as e:
+                    resultados.append(e)
+            return resultados
+
+        partes = [chamadas[i:i + max_batch] for i in range(0, len(chamadas), max_batch)]
+        por_batch = await asyncio.gather(*(enviar_batch(parte) for parte in partes))
+        return [resultado for resultados in por_batch for resultado in resultados]
+
+    async def close(self):
+        """Fecha a ligação persistente (uma nova chamada volta a abri-la)."""
+        websocket, leitor = self._websocket, self._leitor
+        self._websocket = None
+        if self._tarefas:
+            await asyncio.gather(*self._tarefas, return_exceptions=True)
+        if websocket is not None:
+            await websocket.close()
+        if leitor is not None:
+            await asyncio.gather(leitor, return_exceptions=True)
+
+    async def __aenter__(self):
+        await self._ligar()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
 
     async def menu_dinamico(self):
+        # O input corre numa thread: enquanto o utilizador escreve, o event loop continua a responder
+        # aos pings do servidor e a ligação não é dada como morta
         funcoes = await self.invoke("list_functions")
 
         while True:
@@ -52,7 +321,7 @@ class RPCClientWS:
                 print(f"{idx + 1}. {nome} ({len(parametros)} arg(s)) - {doc}")
             print("0. Sair")
 
-            escolha = input("Escolha uma função: ").strip()
+            escolha = (await asyncio.to_thread(input, "Escolha uma função: ")).strip()
             if escolha == "0":
                 print("A terminar cliente.")
                 break
@@ -67,12 +336,12 @@ class RPCClientWS:
             args = []
 
             if parametros == ["args"]:
-                num = input("Quantos argumentos pretende fornecer? ").strip()
+                num = (await asyncio.to_thread(input, "Quantos argumentos pretende fornecer? ")).strip()
                 if not num.isdigit() or int(num) <= 0:
                     print("Número inválido de argumentos.")
                     continue
                 for i in range(int(num)):
-                    val = input(f"Argumento {i + 1}: ")
+                    val = await asyncio.to_thread(input, f"Argumento {i + 1}: ")
                     try:
                         args.append(ast.literal_eval(val))
                     except Exception:
@@ -81,7 +350,7 @@ class RPCClientWS:
             else:
                 params = {}
                 for param in parametros:
-                    val = input(f"Insira valor para argumento '{param}': ")
+                    val = await asyncio.to_thread(input, f"Insira valor para argumento '{param}': ")
                     try:
                         valor_convertido = ast.literal_eval(val)
                     except Exception:
@@ -96,6 +365,9 @@ class RPCClientWS:
 
 
 if __name__ == "__main__":
-    client = RPCClientWS()
+    async def correr():
+        async with RPCClientWS() as client:
+            await client.menu_dinamico()
+
     print("\n=== A iniciar cliente RPC (WebSocket) ===")
-    asyncio.run(client.menu_dinamico())
+    asyncio.run(correr())
@@ -0,0 +1,123 @@
+## Coordenador distribuído: procura de primos repartida em leases por vários nós servidor_rpc
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from typing import List, Optional
+
+from cliente_rpc import RPCClientWS
+
+INICIO_PADRAO = 10**15 + 1   # a mesma base do find_max_prime_parallel
+TAMANHO_LEASE = 2_000        # candidatos por lease
+MAX_FALHAS_NO = 3            # falhas seguidas até um nó ser dado como morto
+
+
+class Coordenador:
+    """
+    Reparte a procura do maior primo por vários nós (uris ws:// de servidores RPC). O intervalo é dividido
+    em leases [lo, hi) entregues por ordem crescente a cada nó livre, que devolve o maior primo do lease
+    (método largest_prime_in_range). Os leases de um nó que morra (ou falhe) voltam à fila e são entregues
+    a outro nó. No fim do prazo, o resultado é o maior primo entre os leases concluídos, por isso a distância
+    percorrida (e o primo encontrado) cresce com o número de nós.
+    """
+
+    def __init__(self, uris: List[str], tamanho_lease: int = TAMANHO_LEASE, leases_por_no: int = 1):
+        if not uris:
+            raise ValueError("é preciso pelo menos um nó")
+        self.uris = list(uris)
+        self.tamanho_lease = tamanho_lease
+        self.leases_por_no = leases_por_no
+
+    async def procurar_maior_primo(self, prazo: float, inicio: int = INICIO_PADRAO, fim: Optional[int] = None,
+                                   digitos: Optional[int] = None) -> dict:
+        """
+        Procura durante no máximo prazo segundos o maior primo em [inicio, fim) (fim=None: sem limite, como o
+        find_max_prime_parallel), ou entre os números com o número de dígitos indicado.
+        "complete" indica se todo o intervalo foi percorrido antes do prazo.
+        """
+        if digitos is not None:
+            inicio, fim = 10 ** (digitos - 1), 10 ** digitos
+        t0 = time.monotonic()
+        limite = t0 + prazo
+        # "contiguo": todos os leases abaixo deste valor já foram concluídos; os concluídos acima dele
+        # (fora de ordem, porque há leases em voo ou reemitidos) ficam em "pendentes" (lo -> hi)
+        estado = {"proximo": inicio, "em_voo": 0, "melhor": None, "concluidos": 0, "contiguo": inicio}
+        pendentes = {}
+        reemitir = deque()  # leases devolvidos por nós que falharam
+        nos = {uri: {"leases": 0, "failures": 0, "alive": True} for uri in self.uris}
+
+        def proximo_lease():
+            if reemitir:
+                return reemitir.popleft()
+            if fim is not None and estado["proximo"] >= fim:
+                return None
+            lo = estado["proximo"]
+            hi = lo + self.tamanho_lease if fim is None else min(lo + self.tamanho_lease, fim)
+            estado["proximo"] = hi
+            return lo, hi
+
+        async def trabalhar(uri, cliente):
+            no = nos[uri]
+            while no["alive"] and (restante := limite - time.monotonic()) > 0:
+                lease = proximo_lease()
+                if lease is None:
+                    if estado["em_voo"] == 0:
+                        return  # intervalo esgotado
+                    await asyncio.sleep(0.05)  # um lease em voo ainda pode voltar para a fila
+                    continue
+                estado["em_voo"] += 1
+                try:
+                    resultado = await asyncio.wait_for(
+                        cliente.invoke("largest_prime_in_range", [lease[0], lease[1], restante]), restante)
+                except asyncio.TimeoutError:
+                    reemitir.append(lease)  # o prazo acabou: o lease fica por fazer
+                    return
+                except Exception:
+                    reemitir.append(lease)
+                    no["failures"] += 1
+                    if no["failures"] >= MAX_FALHAS_NO:
+                        no["alive"] = False
+                    continue
+                finally:
+                    estado["em_voo"] -= 1
+                no["failures"] = 0
+                no["leases"] += 1
+                estado["concluidos"] += 1
+                pendentes[lease[0]] = lease[1]
+                while estado["contiguo"] in pendentes:
+                    estado["contiguo"] = pendentes.pop(estado["contiguo"])
+                if resultado is not None and (estado["melhor"] is None or resultado > estado["melhor"]):
+                    estado["melhor"] = resultado
+
+        clientes = {uri: RPCClientWS(uri, tentativas_ligacao=1) for uri in self.uris}
+        try:
+            await asyncio.gather(*(trabalhar(uri, cliente) for uri, cliente in clientes.items()
+                                   for _ in range(self.leases_por_no)))
+        finally:
+            await asyncio.gather(*(cliente.close() for cliente in clientes.values()), return_exceptions=True)
+
+        completo = fim is not None and estado["proximo"] >= fim and not reemitir and estado["em_voo"] == 0
+        return {
+            "best": estado["melhor"],
+            "complete": completo,
+            "leases": estado["concluidos"],
+            "scanned_up_to": estado["contiguo"],  # [inicio, scanned_up_to) percorrido sem falhas
+            "elapsed": time.monotonic() - t0,
+            "nodes": nos,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Procura distribuída do maior primo por vários servidores RPC")
+    parser.add_argument("nodes", nargs="+", help="uris dos nós, ex: ws://localhost:8000")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--start", type=int, default=INICIO_PADRAO)
+    parser.add_argument("--end", type=int, default=None)
+    parser.add_argument("--digits", type=int, default=None)
+    parser.add_argument("--lease-size", type=int, default=TAMANHO_LEASE)
+    parser.add_argument("--leases-per-node", type=int, default=1)
+    args = parser.parse_args()
+    coordenador = Coordenador(args.nodes, args.lease_size, args.leases_per_node)
+    resultado = asyncio.run(coordenador.procurar_maior_primo(args.timeout, args.start, args.end, args.digits))
+    print(json.dumps(resultado, indent=2))
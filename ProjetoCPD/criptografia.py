@@ -1,12 +1,19 @@
 ## Componente 2 - Criptografia e Quebra Paralela
 
+import json
+import os
 import random
 import math
-from multiprocessing import Process, Value, Event
+import threading
 import time
-from typing import Tuple
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
 
-from calculo import is_prime, next_prime
+import autotune
+import divisao
+import execucao
+import tabela_primos
+from calculo import INTERVALO_PROGRESSO, is_prime, next_prime
 
 #funções auxiliares
 def mdc(a: int, b: int) -> int:
@@ -105,22 +112,107 @@ def decrypt(cifra: int, private_key: Tuple[int, int]) -> int:
     return pow(cifra, d, n)
 
 
-def _worker_factor(n: int, start: int, step: int, found: Value, stop_event: Event):
+class ArmazemCheckpoints:
+    """
+    Guarda o progresso de fatorações interrompidas, indexado por n.
+    Se for indicado um caminho, os checkpoints são também persistidos num ficheiro JSON,
+    o que permite retomar a fatoração noutro processo (ex: noutra chamada RPC).
+    Guarda no máximo max_checkpoints (sai o usado há mais tempo) e cada um expira retencao
+    segundos depois de ter sido guardado, para um servidor não acumular um por cada n que já viu.
+    """
+
+    def __init__(self, caminho: Optional[str] = None, max_checkpoints: int = 1000, retencao: float = 86400.0):
+        self.caminho = caminho
+        self.max_checkpoints = max_checkpoints
+        self.retencao = retencao
+        self._lock = threading.Lock()
+        self._estados: "OrderedDict[str, dict]" = OrderedDict()  # do menos para o mais recentemente usado
+        if caminho is not None and os.path.exists(caminho):
+            with open(caminho, "r", encoding="utf-8") as f:
+                self._estados = OrderedDict(json.load(f))
+
+    def obter(self, n: int) -> Optional[dict]:
+        """Devolve o checkpoint guardado para n, ou None se não existir (ou tiver expirado)."""
+        with self._lock:
+            self._limpar_expirados()
+            estado = self._estados.get(str(n))
+            if estado is None:
+                return None
+            self._estados.move_to_end(str(n))
+            return {k: v for k, v in estado.items() if k != "guardado"}
+
+    def guardar(self, n: int, estado: dict):
+        """Guarda (ou substitui) o checkpoint de n."""
+        with self._lock:
+            self._estados.pop(str(n), None)
+            self._estados[str(n)] = {**estado, "guardado": time.time()}
+            self._limpar_expirados()
+            while len(self._estados) > self.max_checkpoints:
+                self._estados.popitem(last=False)
+            self._persistir()
+
+    def remover(self, n: int):
+        """Apaga o checkpoint de n (ex: depois de a fatoração terminar)."""
+        with self._lock:
+            if self._estados.pop(str(n), None) is not None:
+                self._persistir()
+
+    def _limpar_expirados(self):
+        limite = time.time() - self.retencao
+        for chave in [chave for chave, estado in self._estados.items() if estado.get("guardado", limite) < limite]:
+            del self._estados[chave]
+
+    def _persistir(self):
+        if self.caminho is None:
+            return
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self._estados, f)
+        os.replace(temporario, self.caminho)
+
+
+# Armazém usado por omissão pelo crack_key (apenas em memória)
+CHECKPOINTS = ArmazemCheckpoints()
+
+BLOCO_FATORIZACAO = divisao.RODA * divisao.TAMANHO_BLOCO // len(divisao.RESIDUOS_RODA)  # divisores por bloco de trabalho
+
+
+def _worker_factor(n: int, inicio: int, indice: int, n_workers: int, found, posicoes, stop_event,
+                   tabela=None, tamanho_bloco: int = BLOCO_FATORIZACAO):
+    # Cada worker processa os blocos indice, indice + n_workers, ... e publica em posicoes[indice]
+    # o início do bloco em curso: todos os divisores abaixo de min(posicoes) já foram testados.
+    # Os blocos abaixo do limite da tabela partilhada só testam primos. found, posicoes e stop_event
+    # vêm do backend de execução (multiprocessing ou threading).
+    tabela = tabela_primos.anexar_tabela(tabela)
     limite = int(math.isqrt(n)) + 1
-    for i in range(start, limite, step):
-        if stop_event.is_set():
+    bloco = indice
+    while not stop_event.is_set():
+        a = inicio + bloco * tamanho_bloco
+        if a >= limite:
+            posicoes[indice] = limite
             return
-        if n % i == 0:
+        posicoes[indice] = a
+        b = min(a + tamanho_bloco, limite)
+        primos = tabela.primos if tabela is not None and b <= tabela.limite else None
+        i = divisao.menor_divisor(n, a, b, primos)
+        if i is not None:
             with found.get_lock():
                 found.value = i
             stop_event.set()
             return
+        bloco += n_workers
 
 
-def crack_key(n: int, e: int, timeout: int = 15) -> Tuple[int, int]:
+def crack_key(n: int, e: int, timeout: int = 15, resume: bool = True, n_workers: Optional[int] = 4, *,
+              progress: Optional[Callable[[dict], None]] = None,
+              cancel: Optional[threading.Event] = None, backend: Optional[str] = None) -> Tuple[int, int]:
     """
         Tenta fatorar n para obter a chave privada a partir da chave pública (n, e). Insira o valor de n e e da chave pública.
-        Timeout é opcional (em segundos). O "e" tem de ser menor que n!! (pode testar por exemplo n=143, e=7)"""
+        Timeout é opcional (em segundos). O "e" tem de ser menor que n!! (pode testar por exemplo n=143, e=7)
+        Se resume for True, continua a partir do checkpoint deixado por uma chamada anterior com o mesmo n.
+        Com n_workers=None, o número de processos e o tamanho dos blocos vêm da calibração desta máquina
+        (feita com python autotune.py; sem ela, um worker por CPU).
+        backend ("process" ou "thread") escolhe onde correm os workers; por omissão, threads num CPython sem GIL."""
 
 
     if not isinstance(n, int) or n <= 1:
@@ -129,31 +221,67 @@ def crack_key(n: int, e: int, timeout: int = 15) -> Tuple[int, int]:
         raise ValueError("O valor de e deve ser um inteiro positivo.")
     if not isinstance(timeout, (int, float)) or timeout <= 0:
         raise ValueError("Timeout deve ser um número positivo.")
+    if n_workers is not None and (not isinstance(n_workers, int) or n_workers < 1):
+        raise ValueError("n_workers deve ser um inteiro positivo.")
+    execucao_workers = execucao.obter_backend(backend)
+
+    inicio = 3
+    tempo_anterior = 0.0
+    checkpoint = CHECKPOINTS.obter(n) if resume else None
+    if checkpoint is not None:
+        inicio = max(3, checkpoint["proximo_divisor"])
+        tempo_anterior = checkpoint.get("tempo", 0.0)
+
+    found = execucao_workers.valor('q', 0)
+    stop_event = execucao_workers.evento()
+
+    # O kernel só testa divisores coprimos com 30, por isso 2, 3 e 5 são testados aqui
+    for d in divisao.PRIMOS_RODA:
+        if inicio <= d < n and n % d == 0:
+            found.value = d
+            stop_event.set()
+            break
 
-    found = Value('q', 0)
-    stop_event = Event()
-
-    n_processes = 4
-    step = 2 * n_processes  # apenas números ímpares
+    if n_workers is None:
+        n_processes = autotune.melhor_n_workers(timeout)
+        tamanho_bloco = autotune.melhor_tamanho_bloco() or BLOCO_FATORIZACAO
+    else:
+        n_processes = n_workers
+        tamanho_bloco = BLOCO_FATORIZACAO
+    posicoes = execucao_workers.vetor('q', [inicio] * n_processes)
+    tabela = tabela_primos.obter_tabela()
 
     procs = []
     for i in range(n_processes):
-        start = 3 + 2 * i
-        p = Process(target=_worker_factor, args=(n, start, step, found, stop_event))
-        p.start()
+        p = execucao_workers.iniciar(_worker_factor, (n, inicio, i, n_processes, found, posicoes, stop_event,
+                                                      tabela.descritor, tamanho_bloco))
         procs.append(p)
 
     start_time = time.time()
-    while time.time() - start_time < timeout and not stop_event.is_set():
+    proximo_progresso = start_time + INTERVALO_PROGRESSO
+    limite = int(math.isqrt(n)) + 1
+    while (time.time() - start_time < timeout and not stop_event.is_set()
+           and any(p.is_alive() for p in procs) and not (cancel is not None and cancel.is_set())):
         time.sleep(0.1)
+        if progress is not None and time.time() >= proximo_progresso:
+            progress({"scanned_up_to": min(posicoes), "limit": limite, "elapsed": time.time() - start_time})
+            proximo_progresso = time.time() + INTERVALO_PROGRESSO
 
     stop_event.set()
     for p in procs:
         p.join()
 
     if found.value == 0:
-        raise TimeoutError("Fatoração não concluída no tempo limite")
-
+        proximo_divisor = min(posicoes)
+        CHECKPOINTS.guardar(n, {
+            "proximo_divisor": proximo_divisor,
+            "tempo": tempo_anterior + time.time() - start_time,
+        })
+        if cancel is not None and cancel.is_set():
+            raise InterruptedError(f"Fatoração cancelada (divisores testados até {proximo_divisor})")
+        raise TimeoutError(f"Fatoração não concluída no tempo limite (divisores testados até {proximo_divisor})")
+
+    CHECKPOINTS.remover(n)
     p = found.value
     q = n // p
     phi = (p - 1) * (q - 1)
@@ -0,0 +1,144 @@
+## Kernel de divisão por tentativa (vetorizado com NumPy quando disponível)
+import bisect
+import math
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy é opcional: sem ele usa-se o ciclo em Python
+    np = None
+
+RODA = 30
+RESIDUOS_RODA = (1, 7, 11, 13, 17, 19, 23, 29)  # restos mod 30 coprimos com 2, 3 e 5
+PRIMOS_RODA = (2, 3, 5)
+TAMANHO_BLOCO = 1 << 16  # candidatos por operação vetorizada (múltiplo de 8)
+
+LIMITE_INT64 = 1 << 63
+LIMITE_MULTI_LIMB = 1 << 32  # divisores até 2^32 permitem (r << 32) | limb em uint64
+PRIMEIRO_BLOCO_PRIMOS = 256  # com uma tabela de primos, o primeiro bloco é pequeno (a maioria dos números tem um fator pequeno)
+
+if np is not None:
+    # Deslocamentos (a partir de um múltiplo de 30) dos candidatos de um bloco completo
+    _DESLOCAMENTOS = (np.arange(TAMANHO_BLOCO // len(RESIDUOS_RODA), dtype=np.int64)[:, None] * RODA
+                      + np.array(RESIDUOS_RODA, dtype=np.int64)).ravel()
+    _SPAN_BLOCO = RODA * (TAMANHO_BLOCO // len(RESIDUOS_RODA))
+
+
+def _limbs(n: int):
+    """Decompõe n em limbs de 32 bits, do mais significativo para o menos significativo."""
+    limbs = []
+    while n:
+        limbs.append(n & 0xFFFFFFFF)
+        n >>= 32
+    return np.array(limbs[::-1], dtype=np.uint64)
+
+
+def _restos(n: int, limbs, candidatos):
+    if limbs is None:
+        return np.remainder(np.int64(n), candidatos.astype(np.int64, copy=False))
+    # Redução de Horner limb a limb: r = (r * 2^32 + limb) mod d, sempre abaixo de 2^64
+    divisores = candidatos.astype(np.uint64)
+    restos = np.zeros_like(divisores)
+    for limb in limbs:
+        restos = ((restos << np.uint64(32)) | limb) % divisores
+    return restos
+
+
+def _menor_divisor_numpy(n: int, inicio: int, fim: int) -> Optional[int]:
+    limbs = _limbs(n) if n >= LIMITE_INT64 else None
+    base = inicio - inicio % RODA
+    while base < fim:
+        candidatos = _DESLOCAMENTOS + base
+        if base < inicio or base + _SPAN_BLOCO > fim:
+            candidatos = candidatos[(candidatos >= inicio) & (candidatos < fim)]
+        zeros = np.flatnonzero(_restos(n, limbs, candidatos) == 0)
+        if zeros.size:
+            return int(candidatos[zeros[0]])
+        base += _SPAN_BLOCO
+    return None
+
+
+def _menor_divisor_primos(n: int, inicio: int, fim: int, primos) -> Optional[int]:
+    if np is not None and isinstance(primos, np.ndarray):
+        i, j = (int(k) for k in np.searchsorted(primos, [inicio, fim]))
+        usar_numpy = n < LIMITE_INT64 and fim <= LIMITE_INT64 or fim <= LIMITE_MULTI_LIMB
+    else:
+        i = bisect.bisect_left(primos, inicio)
+        j = bisect.bisect_left(primos, fim, i)
+        usar_numpy = False
+    if not usar_numpy:
+        for k in range(i, j):
+            if n % int(primos[k]) == 0:
+                return int(primos[k])
+        return None
+    limbs = _limbs(n) if n >= LIMITE_INT64 else None
+    tamanho = PRIMEIRO_BLOCO_PRIMOS
+    while i < j:
+        candidatos = primos[i:min(i + tamanho, j)]
+        zeros = np.flatnonzero(_restos(n, limbs, candidatos) == 0)
+        if zeros.size:
+            return int(candidatos[zeros[0]])
+        i += tamanho
+        tamanho = min(tamanho * 16, TAMANHO_BLOCO)
+    return None
+
+
+def _menor_divisor_python(n: int, inicio: int, fim: int) -> Optional[int]:
+    base = inicio - inicio % RODA
+    for b in range(base, fim, RODA):
+        for r in RESIDUOS_RODA:
+            d = b + r
+            if inicio <= d < fim and n % d == 0:
+                return d
+    return None
+
+
+def menor_divisor(n: int, inicio: int, fim: int, primos=None) -> Optional[int]:
+    """
+    Devolve o menor divisor d de n com inicio <= d < fim e d coprimo com 30 (os primos 2, 3 e 5
+    ficam a cargo de quem chama), ou None se não existir nenhum.
+    Usa o kernel NumPy para n < 2^63 (ou divisores < 2^32, com redução multi-limb); caso contrário,
+    ou sem NumPy, usa um ciclo em Python sobre a mesma roda.
+    primos (opcional) é uma sequência ordenada com todos os primos abaixo de fim (ex: tabela_primos):
+    nesse caso só se testam primos, o que dá o mesmo resultado quando n não tem fatores primos abaixo
+    de inicio (como acontece na fatorização, que os vai dividindo).
+    """
+    inicio = max(inicio, 2)
+    if inicio >= fim:
+        return None
+    if primos is not None:
+        return _menor_divisor_primos(n, max(inicio, 7), fim, primos)
+    if np is not None and (n < LIMITE_INT64 and fim <= LIMITE_INT64 or fim <= LIMITE_MULTI_LIMB):
+        return _menor_divisor_numpy(n, inicio, fim)
+    return _menor_divisor_python(n, inicio, fim)
+
+
+def fatores_primos(n: int, tabela=None):
+    """
+    Decompõe n (>= 0) nos seus fatores primos, em ordem crescente, usando o kernel por blocos.
+    Com uma tabela de primos (tabela_primos.TabelaPrimos), os divisores abaixo do seu limite
+    são procurados só entre os primos da tabela.
+    """
+    factors = []
+    if n < 2:
+        return factors
+    for p in PRIMOS_RODA:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+    d = 7
+    while d * d <= n:
+        fim = min(d + RODA * TAMANHO_BLOCO // len(RESIDUOS_RODA), math.isqrt(n) + 1)
+        primos = tabela.primos if tabela is not None and fim <= tabela.limite else None
+        f = menor_divisor(n, d, fim, primos)
+        if f is None:
+            d = fim
+            continue
+        # f é o menor divisor restante, logo é primo
+        while n % f == 0:
+            factors.append(f)
+            n //= f
+        d = f + 1
+    if n > 1:
+        factors.append(n)
+    return factors
@@ -0,0 +1,45 @@
+## Estado partilhado pelos workers do servidor multi-processo: a tabela de trabalhos e os checkpoints
+## do crack_key vivem no processo pai e os workers usam-nos através de proxies (multiprocessing.managers)
+import os
+import threading
+from multiprocessing.managers import BaseManager
+
+import trabalhos
+
+_partilhados = {}  # só preenchido no processo que serve o estado
+
+
+def _tabela():
+    return _partilhados["tabela"]
+
+
+def _checkpoints():
+    return _partilhados["checkpoints"]
+
+
+class GestorEstado(BaseManager):
+    """Servidor (no processo pai) e clientes (nos workers) do estado partilhado."""
+
+
+GestorEstado.register("tabela", callable=_tabela,
+                      exposed=("criar", "iniciar", "concluir", "obter", "estado", "resultado"))
+GestorEstado.register("checkpoints", callable=_checkpoints, exposed=("obter", "guardar", "remover"))
+
+
+def servir(tabela, checkpoints, host: str = "127.0.0.1"):
+    """
+    Põe tabela (TabelaTrabalhos) e checkpoints (ArmazemCheckpoints) deste processo à disposição de
+    outros processos, servidos por uma thread. Devolve (endereço, chave), os argumentos de ligar.
+    """
+    _partilhados.update(tabela=tabela, checkpoints=checkpoints)
+    chave = os.urandom(16)
+    servidor = GestorEstado(address=(host, 0), authkey=chave).get_server()
+    threading.Thread(target=servidor.serve_forever, name="estado-partilhado", daemon=True).start()
+    return servidor.address, chave
+
+
+def ligar(endereco, chave: bytes):
+    """Liga ao estado servido por servir noutro processo; devolve (TabelaRemota, proxy dos checkpoints)."""
+    gestor = GestorEstado(address=endereco, authkey=chave)
+    gestor.connect()
+    return trabalhos.TabelaRemota(gestor.tabela()), gestor.checkpoints()
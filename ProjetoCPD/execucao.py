@@ -0,0 +1,113 @@
+## Backends de execução dos workers paralelos: processos (por omissão) ou threads (CPython sem GIL)
+import multiprocessing
+import os
+import sys
+import threading
+from typing import Optional
+
+BACKENDS = ("process", "thread")
+
+# Backend global: "process", "thread" ou None (automático); pode vir da variável de ambiente
+_backend_global = os.environ.get("PROJETOCPD_BACKEND") or None
+
+
+def gil_ativo() -> bool:
+    """False só num CPython free-threaded (3.13t+) a correr sem GIL."""
+    return getattr(sys, "_is_gil_enabled", lambda: True)()
+
+
+def definir_backend(nome: Optional[str]):
+    """Define o backend usado pelas chamadas que não indicam nenhum (None volta ao automático)."""
+    global _backend_global
+    if nome is not None and nome not in BACKENDS:
+        raise ValueError(f"backend deve ser um de {BACKENDS} ou None.")
+    _backend_global = nome
+
+
+def escolher_backend(backend: Optional[str] = None) -> str:
+    """
+    Backend de uma chamada: o indicado, senão o global, senão threads quando não há GIL
+    (arranque quase instantâneo e estado partilhado sem IPC) e processos caso contrário.
+    """
+    nome = backend or _backend_global
+    if nome is None:
+        return "process" if gil_ativo() else "thread"
+    if nome not in BACKENDS:
+        raise ValueError(f"backend deve ser um de {BACKENDS} ou None.")
+    return nome
+
+
+class _Valor:
+    """Equivalente em memória de multiprocessing.Value para workers que são threads."""
+
+    def __init__(self, valor):
+        self.value = valor
+        self._lock = threading.Lock()
+
+    def get_lock(self):
+        return self._lock
+
+
+class BackendProcessos:
+    """Workers em processos separados; o estado partilhado vive em memória partilhada de multiprocessing."""
+    nome = "process"
+
+    @staticmethod
+    def valor(typecode: str, valor):
+        return multiprocessing.Value(typecode, valor)
+
+    @staticmethod
+    def vetor(typecode: str, valores):
+        return multiprocessing.Array(typecode, valores, lock=False)
+
+    @staticmethod
+    def lock():
+        return multiprocessing.Lock()
+
+    @staticmethod
+    def evento():
+        return multiprocessing.Event()
+
+    @staticmethod
+    def iniciar(target, args):
+        p = multiprocessing.Process(target=target, args=args)
+        p.start()
+        return p
+
+
+class BackendThreads:
+    """
+    Workers em threads deste processo: o estado partilhado são objetos Python normais, sem pickling
+    nem arranque de processos. Só há paralelismo real num CPython sem GIL.
+    """
+    nome = "thread"
+
+    @staticmethod
+    def valor(typecode: str, valor):
+        return _Valor(valor)
+
+    @staticmethod
+    def vetor(typecode: str, valores):
+        return [0] * valores if isinstance(valores, int) else list(valores)
+
+    @staticmethod
+    def lock():
+        return threading.Lock()
+
+    @staticmethod
+    def evento():
+        return threading.Event()
+
+    @staticmethod
+    def iniciar(target, args):
+        t = threading.Thread(target=target, args=args, daemon=True)
+        t.start()
+        return t
+
+
+_INSTANCIAS = {"process": BackendProcessos(), "thread": BackendThreads()}
+
+
+def obter_backend(backend: Optional[str] = None):
+    """Objeto com as primitivas (valor, vetor, lock, evento, iniciar) do backend escolhido para a chamada."""
+    return _INSTANCIAS[escolher_backend(backend)]
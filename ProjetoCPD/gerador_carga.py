@@ -0,0 +1,224 @@
+## Gerador de carga para o servidor RPC: débito e percentis de latência por método, em JSON
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from cliente_rpc import RPCClientWS
+
+# Mistura por omissão: chamadas leves (inline e em cache) com algumas pesadas, como um cliente típico.
+# Cada parâmetro é um valor fixo ou uma distribuição: {"uniform": [a, b]} (inteiros ou reais, conforme
+# os limites) ou {"choice": [v1, v2, ...]}.
+MISTURA_PADRAO = [
+    {"method": "is_prime", "weight": 50, "params": {"n": {"uniform": [10**6, 10**12]}}},
+    {"method": "next_prime", "weight": 20, "params": {"n": {"uniform": [10**3, 10**9]}}},
+    {"method": "prime_factors", "weight": 20, "params": {"n": {"uniform": [10**3, 10**9]}}},
+    {"method": "mdc", "weight": 10, "params": {"a": {"uniform": [1, 10**9]}, "b": {"uniform": [1, 10**9]}}},
+]
+
+
+def gerar_valor(especificacao, rng: random.Random):
+    """Um valor de um parâmetro da mistura (fixo ou tirado da distribuição indicada)."""
+    if isinstance(especificacao, dict) and len(especificacao) == 1:
+        (tipo, argumentos), = especificacao.items()
+        if tipo == "uniform":
+            a, b = argumentos
+            if isinstance(a, int) and isinstance(b, int):
+                return rng.randint(a, b)
+            return rng.uniform(a, b)
+        if tipo == "choice":
+            return rng.choice(argumentos)
+    return especificacao
+
+
+def gerar_params(params, rng: random.Random):
+    if isinstance(params, dict):
+        return {nome: gerar_valor(valor, rng) for nome, valor in params.items()}
+    if isinstance(params, list):
+        return [gerar_valor(valor, rng) for valor in params]
+    return params
+
+
+def percentil(ordenadas: List[float], q: float) -> float:
+    """Percentil q (0-100) exato, pelo método do rank mais próximo, de uma lista já ordenada."""
+    if not ordenadas:
+        return 0.0
+    return ordenadas[max(math.ceil(q / 100 * len(ordenadas)) - 1, 0)]
+
+
+class _Estatisticas:
+    # Guarda todas as latências (e não um histograma de buckets, como o servidor): os percentis
+    # saem exatos e pequenas diferenças entre versões do servidor continuam visíveis
+    def __init__(self):
+        self.erros = 0
+        self.tipos_erro: Dict[str, int] = defaultdict(int)
+        self.latencias: List[float] = []
+
+    def registar(self, duracao: float, erro: Optional[BaseException]):
+        self.latencias.append(duracao)
+        if erro is not None:
+            self.erros += 1
+            self.tipos_erro[type(erro).__name__] += 1
+
+    def resumo(self, duracao: float) -> dict:
+        pedidos = len(self.latencias)
+        ordenadas = sorted(self.latencias)
+        return {
+            "requests": pedidos,
+            "errors": self.erros,
+            "error_rate": self.erros / pedidos if pedidos else 0.0,
+            "requests_per_sec": pedidos / duracao if duracao > 0 else 0.0,
+            "latency": {
+                "mean": sum(ordenadas) / pedidos if pedidos else 0.0,
+                "p50": percentil(ordenadas, 50),
+                "p95": percentil(ordenadas, 95),
+                "p99": percentil(ordenadas, 99),
+                "max": ordenadas[-1] if ordenadas else 0.0,
+            },
+            "error_types": dict(self.tipos_erro),
+        }
+
+
+class GeradorCarga:
+    """
+    Envia uma mistura de chamadas ao servidor em uri por ligacoes ligações persistentes (RPCClientWS),
+    abertas ao longo de rampa segundos. Dois modos:
+      - "closed": concorrencia chamadas sempre em curso (cada uma começa quando a anterior acaba);
+      - "open": taxa chamadas por segundo a intervalos fixos, esperem ou não pelas anteriores.
+        A latência conta a partir do instante agendado, por isso um servidor atrasado não a esconde.
+    """
+
+    def __init__(self, uri: str = "ws://localhost:8000", mistura: Optional[List[dict]] = None, ligacoes: int = 1,
+                 rampa: float = 0.0, binario: bool = True, seed: Optional[int] = None):
+        if not isinstance(ligacoes, int) or ligacoes < 1:
+            raise ValueError("ligacoes deve ser um inteiro positivo.")
+        self.uri = uri
+        self.mistura = mistura or MISTURA_PADRAO
+        self.ligacoes = ligacoes
+        self.rampa = rampa
+        self.binario = binario
+        self.rng = random.Random(seed)
+        self._metodos = [entrada["method"] for entrada in self.mistura]
+        self._pesos = [entrada.get("weight", 1) for entrada in self.mistura]
+        self._clientes: List[RPCClientWS] = []
+        self._proximo = 0
+        self._estatisticas: Dict[str, _Estatisticas] = defaultdict(_Estatisticas)
+        self._total = _Estatisticas()
+
+    def _proxima_chamada(self):
+        entrada = self.rng.choices(self.mistura, weights=self._pesos)[0]
+        return entrada["method"], gerar_params(entrada.get("params"), self.rng)
+
+    def _cliente(self) -> RPCClientWS:
+        # Reparte as chamadas pelas ligações já abertas
+        self._proximo += 1
+        return self._clientes[self._proximo % len(self._clientes)]
+
+    async def _abrir_ligacao(self, pilha: contextlib.AsyncExitStack):
+        self._clientes.append(await pilha.enter_async_context(RPCClientWS(self.uri, binario=self.binario)))
+
+    async def _rampa(self, pilha: contextlib.AsyncExitStack):
+        # Abre as restantes ligações a intervalos regulares enquanto a carga já está a correr
+        for _ in range(self.ligacoes - 1):
+            await asyncio.sleep(self.rampa / (self.ligacoes - 1))
+            await self._abrir_ligacao(pilha)
+
+    async def _chamar(self, inicio: float):
+        method, params = self._proxima_chamada()
+        erro = None
+        try:
+            await self._cliente().invoke(method, params)
+        except Exception as e:
+            erro = e
+        duracao = time.perf_counter() - inicio
+        self._estatisticas[method].registar(duracao, erro)
+        self._total.registar(duracao, erro)
+
+    async def _fechado(self, fim: float, concorrencia: int):
+        async def utilizador():
+            while time.perf_counter() < fim:
+                await self._chamar(time.perf_counter())
+
+        await asyncio.gather(*(utilizador() for _ in range(concorrencia)))
+
+    async def _aberto(self, fim: float, taxa: float):
+        intervalo = 1 / taxa
+        agendado = time.perf_counter()
+        em_curso = set()
+        while agendado < fim:
+            atraso = agendado - time.perf_counter()
+            if atraso > 0:
+                await asyncio.sleep(atraso)
+            tarefa = asyncio.ensure_future(self._chamar(agendado))
+            em_curso.add(tarefa)
+            tarefa.add_done_callback(em_curso.discard)
+            agendado += intervalo
+        if em_curso:
+            await asyncio.gather(*em_curso)
+
+    async def correr(self, duracao: float, modo: str = "closed", concorrencia: int = 8,
+                     taxa: Optional[float] = None) -> dict:
+        """Gera carga durante duracao segundos (a rampa de ligações conta para a duração) e devolve o relatório."""
+        if modo not in ("closed", "open"):
+            raise ValueError('modo deve ser "closed" ou "open".')
+        if modo == "closed" and (not isinstance(concorrencia, int) or concorrencia < 1):
+            raise ValueError("concorrencia deve ser um inteiro positivo.")
+        if modo == "open" and (taxa is None or taxa <= 0):
+            raise ValueError("taxa deve ser um número positivo no modo open.")
+        self._estatisticas.clear()
+        self._total = _Estatisticas()
+        self._clientes = []
+        async with contextlib.AsyncExitStack() as pilha:
+            await self._abrir_ligacao(pilha)
+            inicio = time.perf_counter()
+            rampa = asyncio.ensure_future(self._rampa(pilha))
+            try:
+                if modo == "closed":
+                    await self._fechado(inicio + duracao, concorrencia)
+                else:
+                    await self._aberto(inicio + duracao, taxa)
+            finally:
+                rampa.cancel()
+                await asyncio.gather(rampa, return_exceptions=True)
+            decorrido = time.perf_counter() - inicio
+        return self._relatorio(decorrido, modo, concorrencia if modo == "closed" else None, taxa)
+
+    def _relatorio(self, duracao: float, modo: str, concorrencia: Optional[int], taxa: Optional[float]) -> dict:
+        return {
+            "uri": self.uri,
+            "mode": modo,
+            "concurrency": concorrencia,
+            "rate": taxa,
+            "connections": len(self._clientes),
+            "duration": duracao,
+            "total": self._total.resumo(duracao),
+            "methods": {method: self._estatisticas[method].resumo(duracao)
+                        for method in self._metodos if method in self._estatisticas},
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera carga num servidor RPC e mede débito e latências por método")
+    parser.add_argument("--uri", default="ws://localhost:8000")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="chamadas em curso no modo closed")
+    parser.add_argument("--rate", type=float, default=None, help="chamadas por segundo no modo open")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="segundos para abrir todas as ligações")
+    parser.add_argument("--mix", default=None, help="ficheiro JSON com a mistura de métodos e parâmetros")
+    parser.add_argument("--json-protocol", action="store_true", help="não propõe o protocolo binário")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    mistura = None
+    if args.mix is not None:
+        with open(args.mix, "r", encoding="utf-8") as f:
+            mistura = json.load(f)
+    gerador = GeradorCarga(args.uri, mistura, args.connections, args.ramp_up, not args.json_protocol, args.seed)
+    resultado = asyncio.run(gerador.correr(args.duration, args.mode, args.concurrency, args.rate))
+    print(json.dumps(resultado, indent=2))
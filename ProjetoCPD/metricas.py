@@ -0,0 +1,109 @@
+## Métricas do servidor RPC: contadores e histogramas de latência por método
+import bisect
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Limites superiores dos buckets de latência (segundos): 0.1 ms a ~105 s, a duplicar
+LIMITES_LATENCIA = [0.0001 * 2 ** i for i in range(21)]
+
+
+class Histograma:
+    """Histograma de buckets fixos: registar custa uma procura binária e os percentis são aproximados por cima."""
+
+    def __init__(self, limites: List[float] = LIMITES_LATENCIA):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)  # o último bucket é +Inf
+        self.total = 0
+        self.soma = 0.0
+        self.maximo = 0.0
+
+    def registar(self, valor: float):
+        self.contagens[bisect.bisect_left(self.limites, valor)] += 1
+        self.total += 1
+        self.soma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def percentil(self, q: float) -> float:
+        """Limite superior do bucket onde cai o percentil q (0-100); o máximo observado se cair no +Inf."""
+        if self.total == 0:
+            return 0.0
+        alvo = q / 100 * self.total
+        acumulado = 0
+        for i, contagem in enumerate(self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo and contagem:
+                return min(self.limites[i], self.maximo) if i < len(self.limites) else self.maximo
+        return self.maximo
+
+    def resumo(self) -> dict:
+        return {
+            "count": self.total,
+            "mean": self.soma / self.total if self.total else 0.0,
+            "p50": self.percentil(50),
+            "p95": self.percentil(95),
+            "p99": self.percentil(99),
+            "max": self.maximo,
+        }
+
+
+class Metricas:
+    """
+    Métricas recolhidas pelo servidor. Só é atualizada a partir do event loop,
+    por isso não precisa de locks.
+    """
+
+    def __init__(self):
+        self.pedidos: Dict[str, int] = defaultdict(int)
+        self.erros: Dict[str, int] = defaultdict(int)
+        self.latencias: Dict[str, Histograma] = defaultdict(Histograma)
+        self.em_curso = 0
+        self.ocupados: Dict[str, int] = defaultdict(int)  # chamadas a correr em cada pool ("thread"/"process")
+
+    def registar(self, method: str, duracao: float, erro: bool):
+        self.pedidos[method] += 1
+        if erro:
+            self.erros[method] += 1
+        self.latencias[method].registar(duracao)
+
+    def por_metodo(self) -> dict:
+        return {
+            method: {"requests": self.pedidos[method], "errors": self.erros[method],
+                     "latency": self.latencias[method].resumo()}
+            for method in sorted(self.pedidos)
+        }
+
+
+def _rotulos(**rotulos) -> str:
+    texto = ",".join(f'{k}="{str(v)}"' for k, v in rotulos.items())
+    return "{" + texto + "}" if texto else ""
+
+
+def texto_prometheus(metricas: Metricas, medidores: List[Tuple[str, dict, float]]) -> str:
+    """
+    Formata as métricas no formato de texto do Prometheus. medidores são valores instantâneos
+    (nome, rótulos, valor), ex: ("rpc_queued", {"class": "leve"}, 3), juntos pelo servidor no momento do pedido.
+    """
+    linhas = [
+        "# TYPE rpc_requests_total counter",
+        *(f"rpc_requests_total{_rotulos(method=m)} {n}" for m, n in sorted(metricas.pedidos.items())),
+        "# TYPE rpc_errors_total counter",
+        *(f"rpc_errors_total{_rotulos(method=m)} {metricas.erros[m]}" for m in sorted(metricas.pedidos)),
+        "# TYPE rpc_request_duration_seconds histogram",
+    ]
+    for method in sorted(metricas.latencias):
+        histograma = metricas.latencias[method]
+        acumulado = 0
+        for limite, contagem in zip(histograma.limites + ["+Inf"], histograma.contagens):
+            acumulado += contagem
+            le = limite if limite == "+Inf" else f"{limite:g}"
+            linhas.append(f"rpc_request_duration_seconds_bucket{_rotulos(method=method, le=le)} {acumulado}")
+        linhas.append(f"rpc_request_duration_seconds_sum{_rotulos(method=method)} {histograma.soma}")
+        linhas.append(f"rpc_request_duration_seconds_count{_rotulos(method=method)} {histograma.total}")
+    declarados = set()
+    for nome, rotulos, valor in medidores:
+        if nome not in declarados:
+            linhas.append(f"# TYPE {nome} gauge")
+            declarados.add(nome)
+        linhas.append(f"{nome}{_rotulos(**rotulos)} {valor}")
+    return "\n".join(linhas) + "\n"
@@ -0,0 +1,135 @@
+## Protocolo binário compacto para JSON-RPC (alternativa ao texto JSON, negociada por subprotocolo websocket)
+import struct
+from typing import Any, Tuple
+
+SUBPROTOCOLO = "jsonrpc-bin"
+VERSAO = 1
+
+# Etiquetas de tipo (1 byte antes de cada valor)
+_NULO, _VERDADE, _FALSO = b"N", b"T", b"F"
+_INT_POS, _INT_NEG = b"I", b"J"  # magnitude em bytes big-endian, precedida do comprimento
+_FLOAT = b"D"                    # double IEEE 754 (8 bytes)
+_STR = b"S"                      # comprimento + UTF-8
+_LISTA = b"L"                    # número de elementos + elementos
+_DICT = b"M"                     # número de pares + (chave, valor)...
+
+
+class ErroProtocolo(ValueError):
+    """A mensagem binária está mal formada."""
+
+
+def _varint(n: int, saida: bytearray):
+    while n >= 0x80:
+        saida.append((n & 0x7F) | 0x80)
+        n >>= 7
+    saida.append(n)
+
+
+def _ler_varint(dados: bytes, pos: int) -> Tuple[int, int]:
+    n = 0
+    deslocamento = 0
+    while True:
+        if pos >= len(dados):
+            raise ErroProtocolo("varint truncado")
+        byte = dados[pos]
+        pos += 1
+        n |= (byte & 0x7F) << deslocamento
+        if byte < 0x80:
+            return n, pos
+        deslocamento += 7
+
+
+def _codificar(valor: Any, saida: bytearray):
+    if valor is None:
+        saida += _NULO
+    elif valor is True:
+        saida += _VERDADE
+    elif valor is False:
+        saida += _FALSO
+    elif isinstance(valor, int):
+        magnitude = abs(valor)
+        corpo = magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "big")
+        saida += _INT_NEG if valor < 0 else _INT_POS
+        _varint(len(corpo), saida)
+        saida += corpo
+    elif isinstance(valor, float):
+        saida += _FLOAT
+        saida += struct.pack(">d", valor)
+    elif isinstance(valor, str):
+        corpo = valor.encode("utf-8")
+        saida += _STR
+        _varint(len(corpo), saida)
+        saida += corpo
+    elif isinstance(valor, (list, tuple)):
+        saida += _LISTA
+        _varint(len(valor), saida)
+        for elemento in valor:
+            _codificar(elemento, saida)
+    elif isinstance(valor, dict):
+        saida += _DICT
+        _varint(len(valor), saida)
+        for chave, elemento in valor.items():
+            _codificar(str(chave), saida)
+            _codificar(elemento, saida)
+    else:
+        raise TypeError(f"Tipo não suportado pelo protocolo binário: {type(valor).__name__}")
+
+
+def _descodificar(dados: bytes, pos: int) -> Tuple[Any, int]:
+    if pos >= len(dados):
+        raise ErroProtocolo("mensagem truncada")
+    etiqueta = dados[pos:pos + 1]
+    pos += 1
+    if etiqueta == _NULO:
+        return None, pos
+    if etiqueta == _VERDADE:
+        return True, pos
+    if etiqueta == _FALSO:
+        return False, pos
+    if etiqueta in (_INT_POS, _INT_NEG):
+        comprimento, pos = _ler_varint(dados, pos)
+        if pos + comprimento > len(dados):
+            raise ErroProtocolo("inteiro truncado")
+        magnitude = int.from_bytes(dados[pos:pos + comprimento], "big")
+        return (-magnitude if etiqueta == _INT_NEG else magnitude), pos + comprimento
+    if etiqueta == _FLOAT:
+        if pos + 8 > len(dados):
+            raise ErroProtocolo("float truncado")
+        return struct.unpack(">d", dados[pos:pos + 8])[0], pos + 8
+    if etiqueta == _STR:
+        comprimento, pos = _ler_varint(dados, pos)
+        if pos + comprimento > len(dados):
+            raise ErroProtocolo("string truncada")
+        return dados[pos:pos + comprimento].decode("utf-8"), pos + comprimento
+    if etiqueta == _LISTA:
+        quantidade, pos = _ler_varint(dados, pos)
+        lista = []
+        for _ in range(quantidade):
+            elemento, pos = _descodificar(dados, pos)
+            lista.append(elemento)
+        return lista, pos
+    if etiqueta == _DICT:
+        quantidade, pos = _ler_varint(dados, pos)
+        dicionario = {}
+        for _ in range(quantidade):
+            chave, pos = _descodificar(dados, pos)
+            dicionario[chave], pos = _descodificar(dados, pos)
+        return dicionario, pos
+    raise ErroProtocolo(f"etiqueta desconhecida: {etiqueta!r}")
+
+
+def codificar(mensagem: Any) -> bytes:
+    """Codifica uma mensagem JSON-RPC (pedido, resposta ou batch) numa frame binária."""
+    saida = bytearray([VERSAO])
+    _codificar(mensagem, saida)
+    return bytes(saida)
+
+
+def descodificar(frame: bytes) -> Any:
+    """Descodifica uma frame produzida por codificar. Lança ErroProtocolo se estiver mal formada."""
+    if not frame or frame[0] != VERSAO:
+        raise ErroProtocolo("versão do protocolo binário não suportada")
+    mensagem, pos = _descodificar(frame, 1)
+    if pos != len(frame):
+        raise ErroProtocolo("bytes a mais no fim da frame")
+    return mensagem
@@ -1,16 +1,50 @@
+import argparse
+import array
 import asyncio
+import functools
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
 import websockets
 import json
 import inspect
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import admissao
+import autotune
+import cache_rpc
 import calculo
 import criptografia
+import estado_partilhado
+import metricas
+import protocolo_binario
+import tabela_primos
+import trabalhos
 
 PORT = 8000
 HOST = 'localhost'
+METRICS_PORT = None                   # porta HTTP local com as métricas no formato do Prometheus (None = desligado)
+
+MAX_THREADS = 8                       # chamadas simultâneas em modo "thread"
+MAX_PROCESSOS = os.cpu_count() or 1   # processos do pool usado em modo "process"
+MAX_PARALELISMO_BATCH = 16            # pedidos de um batch executados em simultâneo
+SLOTS_CPU = os.cpu_count() or 1      # orçamento global de CPU para cálculos fora do event loop
+MAX_FILA = {"leve": 256, "pesada": 16}  # pedidos à espera de slots, por classe
+MAX_PEDIDOS_POR_LIGACAO = 32          # pedidos em execução simultânea por cliente
+TRABALHOS_MAX = 1000                  # trabalhos (submit) guardados na tabela
+TRABALHOS_RETENCAO = 3600.0           # segundos durante os quais se guarda o resultado de um trabalho
+TRABALHOS_FICHEIRO = None             # ficheiro JSON onde persistir os trabalhos terminados (opcional)
+INTERVALO_SUBSCRICOES = 0.2           # segundos entre verificações de trabalhos de outros workers (multi-processo)
+CACHE_MAX_ENTRADAS = 10_000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+MAX_INTERVALO_FATORIZACAO = 1 << 20    # números por pedido de prime_factors_range
 
 def get_public_functions(modulos):
     funcoes = {}
-    funcoes_excluir = {"candidate_generator", "worker_dynamic"}
+    funcoes_excluir = {"candidate_generator", "worker_dynamic", "iter_prime_factors_range"}
     for modulo in modulos:
         for nome, func in inspect.getmembers(modulo, inspect.isfunction):
             if not nome.startswith("_") and nome not in funcoes_excluir:
@@ -19,11 +53,414 @@ def get_public_functions(modulos):
 
 FUNCOES = get_public_functions([calculo, criptografia])
 
+# Política de cada método:
+#  - "execucao": "inline" (no próprio event loop), "thread" ou "process". Os métodos baratos correm
+#    inline; os que já lançam os seus próprios processos e só esperam pelo timeout correm numa thread;
+#    o resto (cálculo puro em Python) vai para o pool de processos.
+#  - "cache": se o resultado pode ser reutilizado (só para métodos determinísticos), com
+#    "cache_ttl" em segundos (None = sem expiração). Os métodos limitados por tempo ou aleatórios
+#    (find_max_prime_*, generate_keys, crack_key) nunca vão para a cache.
+#  - "coalescer": se pedidos iguais em simultâneo podem partilhar uma única execução. Nunca para
+#    métodos aleatórios (dois clientes não podem receber as mesmas chaves do generate_keys).
+#  - "progresso": se o método aceita o parâmetro progress e pode enviar notificações de progresso
+#    quando o pedido traz "stream": true.
+#  - "cancelavel": se o método aceita o parâmetro cancel (um threading.Event) e pára quando este é
+#    sinalizado. Só se aplica fora do pool de processos; aí uma chamada já iniciada corre até ao fim.
+#  - "classe": fila de admissão ("leve" é servida antes de "pesada") e "custo": slots de CPU ocupados,
+#    ou o nome do parâmetro com o número de workers (que é reduzido aos slots que couberem ao pedido).
+#    Os métodos inline não passam pela admissão.
+#  - "fora_da_chave": parâmetros que não mudam o resultado (ex: um timeout) e por isso não entram na
+#    chave da cache nem da coalescência.
+#  - "max_intervalo": (lo, hi, limite) para métodos que devolvem um resultado por cada n em [lo, hi):
+#    pedidos com hi - lo > limite são recusados, para a resposta (montada toda em memória) ficar limitada.
+#  - "inline_ate": (parâmetro, limite) para métodos cujo custo cresce com um inteiro: correm inline
+#    quando |parâmetro| < limite e no modo de "execucao" nos restantes casos.
+POLITICA_PADRAO = {"execucao": "process", "cache": False, "cache_ttl": None, "coalescer": False,
+                   "progresso": False, "cancelavel": False, "classe": "leve", "custo": 1, "inline_ate": None,
+                   "fora_da_chave": (), "max_intervalo": None}
+POLITICAS = {
+    "list_functions": {"execucao": "inline"},
+    # Divisão por tentativa, O(√n): ~2 ms em 10^10, mas dezenas de segundos em 10^18
+    "is_prime": {"cache": True, "inline_ate": ("n", 10**10)},
+    "mdc": {"execucao": "inline"},
+    "inverso_modular": {"execucao": "inline"},
+    "encrypt": {"execucao": "inline"},
+    "decrypt": {"execucao": "inline"},
+    "prime_factors": {"cache": True, "coalescer": True},
+    "next_prime": {"cache": True, "coalescer": True},
+    "previous_prime": {"cache": True, "coalescer": True},
+    "is_mersenne_prime": {"cache": True, "coalescer": True},
+    "find_next_twin_primes": {"cache": True, "coalescer": True},
+    "generate_keys": {"classe": "pesada"},
+    # Numa thread, e não no pool de processos, para poder receber o cancel quando o pedido é cancelado
+    "find_max_prime_sequential": {"execucao": "thread", "progresso": True, "cancelavel": True,
+                                  "classe": "pesada"},
+    "find_max_prime_parallel": {"execucao": "thread", "progresso": True, "cancelavel": True,
+                                "classe": "pesada", "custo": "n_workers"},
+    # O timeout só decide se há resposta (os TimeoutError não ficam em cache), não qual é
+    "largest_prime_in_range": {"cache": True, "coalescer": True, "classe": "pesada", "fora_da_chave": ("timeout",)},
+    "prime_factors_range": {"classe": "pesada", "max_intervalo": ("lo", "hi", MAX_INTERVALO_FATORIZACAO)},
+    "prime_factors_many": {"classe": "pesada"},
+    "crack_key": {"execucao": "thread", "coalescer": True, "progresso": True, "cancelavel": True,
+                  "classe": "pesada", "custo": "n_workers"},
+}
+
+CACHE = cache_rpc.CacheResultados(max_entradas=CACHE_MAX_ENTRADAS, max_bytes=CACHE_MAX_BYTES)
+ADMISSAO = admissao.ControloAdmissao(SLOTS_CPU, MAX_FILA)
+TRABALHOS = trabalhos.TabelaTrabalhos(TRABALHOS_MAX, TRABALHOS_RETENCAO, TRABALHOS_FICHEIRO)
+METRICAS = metricas.Metricas()
+
+# Métodos tratados pelo próprio servidor (os restantes vêm de FUNCOES)
+METODOS_SERVIDOR = {"list_functions", "cache_stats", "server_stats", "submit", "job_status", "job_result",
+                    "subscribe", "$/cancelRequest"}
+
+_tarefas_trabalhos = set()  # tarefas dos trabalhos submetidos (não pertencem a nenhuma ligação)
+
+_em_curso = {}  # chave normalizada -> {"tarefa": execução partilhada, "interessados": pedidos à espera}
+
+_executores = {}
+
+
+def obter_politica(method):
+    return {**POLITICA_PADRAO, **POLITICAS.get(method, {})}
+
+
+def obter_executor(modo):
+    executor = _executores.get(modo)
+    if executor is None:
+        if modo == "thread":
+            executor = ThreadPoolExecutor(max_workers=MAX_THREADS)
+        elif modo == "process":
+            # "spawn" evita fazer fork de um processo que já tem threads a correr. Os processos do pool
+            # anexam a tabela de primos do servidor em vez de cada um construir a sua
+            executor = ProcessPoolExecutor(max_workers=MAX_PROCESSOS,
+                                           mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=tabela_primos.anexar_tabela,
+                                           initargs=(tabela_primos.obter_tabela().descritor,))
+        else:
+            raise ValueError(f"Modo de execução desconhecido: {modo}")
+        _executores[modo] = executor
+    return executor
+
+
+def encerrar_executores():
+    for executor in _executores.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executores.clear()
+
+
+def parametros_cliente(method, params):
+    """
+    Tira dos params nomeados os parâmetros keyword-only de FUNCOES[method] (progress, cancel, backend, ...):
+    são de uso interno do servidor e não aparecem no list_functions, por isso um cliente não os pode passar.
+    """
+    if not isinstance(params, dict):
+        return params
+    assinatura = inspect.signature(FUNCOES[method])
+    internos = {p.name for p in assinatura.parameters.values() if p.kind == inspect.Parameter.KEYWORD_ONLY}
+    return {nome: valor for nome, valor in params.items() if nome not in internos}
+
+
+def argumentos_normalizados(method, params):
+    """
+    Associa os parâmetros (posicionais ou nomeados) à assinatura do método, com os valores por omissão
+    preenchidos. Devolve None se não encaixarem na assinatura.
+    """
+    assinatura = inspect.signature(FUNCOES[method])
+    params = parametros_cliente(method, params)
+    try:
+        if isinstance(params, dict):
+            argumentos = assinatura.bind(**params)
+        else:
+            argumentos = assinatura.bind(*params)
+    except TypeError:
+        return None
+    argumentos.apply_defaults()
+    return argumentos.arguments
+
+
+def chave_cache(method, params):
+    """
+    Chave que faz com que chamadas equivalentes partilhem a mesma entrada (None se os params forem inválidos).
+    Os argumentos vêm pela ordem da assinatura e são codificados no protocolo binário, que aceita inteiros
+    de qualquer tamanho (json.dumps falha acima de 4300 dígitos).
+    """
+    argumentos = argumentos_normalizados(method, params)
+    if argumentos is None:
+        return None
+    for nome in obter_politica(method)["fora_da_chave"]:
+        argumentos.pop(nome, None)
+    try:
+        return method, protocolo_binario.codificar(argumentos)
+    except TypeError:
+        return None
+
+
+def custo_pedido(method, params):
+    """Slots de CPU que uma chamada ocupa, segundo a política do método."""
+    custo = obter_politica(method)["custo"]
+    if isinstance(custo, str):
+        argumentos = argumentos_normalizados(method, params) or {}
+        if custo in argumentos and argumentos[custo] is None:
+            # n_workers=None: a função escolhe pela calibração existente (ou pelo número de CPUs)
+            return autotune.melhor_n_workers(argumentos.get("timeout"))
+        custo = argumentos.get(custo)
+        return custo if isinstance(custo, int) and custo > 0 else 1
+    return custo
+
+
+async def calcular(method, params, progresso=None):
+    """
+    Devolve o resultado (já pronto a serializar) de FUNCOES[method], passando pela cache se o método o permitir.
+    Pedidos iguais que cheguem enquanto outro está a ser calculado juntam-se a essa execução
+    (exceto os que pedem progresso, que precisam da sua própria execução).
+    """
+    politica = obter_politica(method)
+    chave = chave_cache(method, params) if politica["cache"] or politica["coalescer"] else None
+    if chave is not None and politica["cache"]:
+        encontrado, resultado = CACHE.obter(chave)
+        if encontrado:
+            return resultado
+
+    if chave is None or not politica["coalescer"] or progresso is not None:
+        return await _calcular_e_guardar(method, params, politica, chave, progresso)
+
+    voo = _em_curso.get(chave)
+    if voo is None:
+        tarefa = asyncio.ensure_future(_calcular_e_guardar(method, params, politica, chave))
+        voo = _em_curso[chave] = {"tarefa": tarefa, "interessados": 0}
+        tarefa.add_done_callback(functools.partial(_terminar_voo, chave))
+    voo["interessados"] += 1
+    try:
+        # shield: se um dos pedidos for cancelado, a execução partilhada continua para os outros
+        return await asyncio.shield(voo["tarefa"])
+    except asyncio.CancelledError:
+        if voo["interessados"] == 1:
+            voo["tarefa"].cancel()  # já ninguém está à espera do resultado: pára o cálculo
+        raise
+    finally:
+        voo["interessados"] -= 1
+
+
+def _terminar_voo(chave, tarefa):
+    if _em_curso.get(chave, {}).get("tarefa") is tarefa:
+        del _em_curso[chave]
+    if not tarefa.cancelled():
+        tarefa.exception()  # marca a exceção como lida, mesmo que já ninguém esteja à espera
+
+
+async def _calcular_e_guardar(method, params, politica, chave, progresso=None):
+    resultado = await executar(method, params, progresso)
+    if isinstance(resultado, (tuple, list)):
+        # ex: os arrays CSR de prime_factors_range passam a listas para poderem ser serializados
+        resultado = [r.tolist() if isinstance(r, array.array) else r for r in resultado]
+
+    if chave is not None and politica["cache"]:
+        CACHE.guardar(chave, resultado, ttl=politica["cache_ttl"])
+    return resultado
+
+
+def modo_execucao(method, params, politica):
+    """Modo de execução de uma chamada: o da política, ou inline se o argumento indicado em "inline_ate" for pequeno."""
+    if politica["inline_ate"] is not None:
+        nome, limite = politica["inline_ate"]
+        valor = (argumentos_normalizados(method, params) or {}).get(nome)
+        if isinstance(valor, int) and abs(valor) < limite:
+            return "inline"
+    return politica["execucao"]
+
+
+def validar_limites(method, params, politica):
+    """Lança ValueError se a chamada pedir um intervalo maior do que o permitido pela política."""
+    if politica["max_intervalo"] is None:
+        return
+    nome_lo, nome_hi, limite = politica["max_intervalo"]
+    argumentos = argumentos_normalizados(method, params) or {}
+    lo, hi = argumentos.get(nome_lo), argumentos.get(nome_hi)
+    if isinstance(lo, int) and isinstance(hi, int) and hi - lo > limite:
+        raise ValueError(f"{method}: no máximo {limite} números por pedido (divida o intervalo em vários pedidos)")
+
+
+def limitar_workers(method, params, politica, slots):
+    """
+    Params da chamada com o número de workers (o parâmetro indicado em "custo") limitado aos slots
+    reservados: um pedido com mais workers do que os slots que lhe couberam (ou com n_workers=None)
+    não pode lançar mais processos do que esses slots.
+    """
+    nome = politica["custo"]
+    argumentos = argumentos_normalizados(method, params) if isinstance(nome, str) else None
+    if argumentos is None or nome not in argumentos:
+        return params
+    pedidos = argumentos[nome]
+    if pedidos is not None and not (isinstance(pedidos, int) and pedidos > slots):
+        return params  # dentro do limite, ou inválido (a função recusa-o com a sua própria mensagem)
+    posicionais = {p.name for p in inspect.signature(FUNCOES[method]).parameters.values()
+                   if p.kind is not inspect.Parameter.KEYWORD_ONLY}
+    return {**{k: v for k, v in argumentos.items() if k in posicionais}, nome: max(slots, 1)}
+
+
+async def executar(method, params, progresso=None):
+    """
+    Executa FUNCOES[method] segundo o modo de execução definido para o método.
+    Se esta corrotina for cancelada, os métodos canceláveis recebem o sinal para parar.
+    """
+    politica = obter_politica(method)
+    params = parametros_cliente(method, params)
+    validar_limites(method, params, politica)
+    modo = modo_execucao(method, params, politica)
+    if progresso is not None and modo == "process":
+        modo = "thread"  # o callback de progresso só funciona dentro deste processo
+
+    cancelar = threading.Event()
+    extra = {}
+    if progresso is not None:
+        extra["progress"] = progresso
+    if politica["cancelavel"] and modo != "process":
+        extra["cancel"] = cancelar
+
+    def preparar(params):
+        # Suporta params como dict ou lista
+        if isinstance(params, dict):
+            return functools.partial(FUNCOES[method], **params, **extra)
+        return functools.partial(FUNCOES[method], *params, **extra)
+
+    if modo == "inline":
+        return preparar(params)()
+
+    loop = asyncio.get_running_loop()
+    controlo = ADMISSAO
+    custo = await controlo.adquirir(politica["classe"], custo_pedido(method, params))
+    METRICAS.ocupados[modo] += 1
+    libertar = functools.partial(_libertar_slots, controlo, modo, custo)
+    try:
+        try:
+            chamada = preparar(limitar_workers(method, params, politica, custo))
+            execucao = obter_executor(modo).submit(chamada)
+        except BaseException:
+            libertar()
+            raise
+        # Os slots só voltam à admissão quando a chamada termina mesmo no executor, e não quando este
+        # pedido é cancelado: uma chamada já iniciada no pool de processos (ou que ainda não viu o
+        # cancel) continua a ocupar o CPU até ao fim
+        execucao.add_done_callback(lambda _: _no_loop(loop, libertar))
+        return await asyncio.wrap_future(execucao)
+    except asyncio.CancelledError:
+        cancelar.set()  # pede à função (e aos seus workers) que parem
+        raise
+    except BrokenProcessPool:
+        # Um processo do pool morreu: descarta o pool para o próximo pedido criar outro
+        executor = _executores.pop(modo, None)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+def _libertar_slots(controlo, modo, custo):
+    METRICAS.ocupados[modo] -= 1
+    controlo.libertar(custo)
+
+
+def _no_loop(loop, funcao):
+    """Corre funcao no event loop a partir de qualquer thread (ou logo, se o loop já tiver fechado)."""
+    try:
+        loop.call_soon_threadsafe(funcao)
+    except RuntimeError:
+        funcao()  # o loop fechou: já não há ninguém a usar a admissão em simultâneo
+
+
+def ler_params(params, *nomes):
+    """Lê os params (posicionais ou nomeados) pela ordem dos nomes indicados; os que faltam ficam None."""
+    if isinstance(params, dict):
+        return [params.get(nome) for nome in nomes]
+    params = list(params or [])[:len(nomes)]
+    return params + [None] * (len(nomes) - len(params))
+
+
+def submeter_trabalho(method, params):
+    """Regista um trabalho e lança-o em segundo plano; devolve o job_id. Sobrevive ao fim da ligação."""
+    if method not in FUNCOES:
+        raise ValueError(f"Método desconhecido: {method}")
+    params = params if params is not None else []
+    job_id = TRABALHOS.criar(method, params)
+    tarefa = asyncio.ensure_future(correr_trabalho(job_id, method, params))
+    _tarefas_trabalhos.add(tarefa)
+    tarefa.add_done_callback(_tarefas_trabalhos.discard)
+    return job_id
+
+
+async def correr_trabalho(job_id, method, params):
+    TRABALHOS.iniciar(job_id)
+    try:
+        resultado = await calcular(method, params)
+    except Exception as e:
+        TRABALHOS.concluir(job_id, erro=str(e))
+    else:
+        TRABALHOS.concluir(job_id, resultado)
+
+
+def subscrever_trabalho(job_id, ligacao):
+    """Envia à ligação uma notificação "job_finished" (com o resultado ou o erro) quando o trabalho terminar."""
+    def notificar(trabalho):
+        ligacao.subscricoes.discard((job_id, notificar))
+        dados = {k: v for k, v in trabalho.items() if k != "params"}
+        ligacao.lancar(ligacao.notificar({"jsonrpc": "2.0", "method": "job_finished", "params": dados}))
+
+    ligacao.subscricoes.add((job_id, notificar))
+    TRABALHOS.subscrever(job_id, notificar)
+    return True
+
+
+def server_stats():
+    """Estado operacional do servidor: pedidos, erros e latências por método, filas, pools e cache."""
+    admissao_stats = ADMISSAO.estatisticas()
+    return {
+        "pid": os.getpid(),
+        "methods": METRICAS.por_metodo(),
+        "in_flight": METRICAS.em_curso,
+        "queued": admissao_stats["queued"],
+        "cpu_slots": {"total": admissao_stats["slots"], "in_use": admissao_stats["slots_in_use"]},
+        "pools": {
+            "thread": {"busy": METRICAS.ocupados["thread"], "size": MAX_THREADS,
+                       "utilisation": METRICAS.ocupados["thread"] / MAX_THREADS},
+            "process": {"busy": METRICAS.ocupados["process"], "size": MAX_PROCESSOS,
+                        "utilisation": METRICAS.ocupados["process"] / MAX_PROCESSOS},
+        },
+        "cache": CACHE.estatisticas(),
+    }
+
+
+def texto_metricas():
+    """As métricas de server_stats no formato de texto do Prometheus."""
+    stats = server_stats()
+    medidores = [("rpc_in_flight", {}, stats["in_flight"])]
+    medidores += [("rpc_queued", {"class": classe}, n) for classe, n in stats["queued"].items()]
+    medidores += [("rpc_cpu_slots_in_use", {}, stats["cpu_slots"]["in_use"]),
+                  ("rpc_cpu_slots", {}, stats["cpu_slots"]["total"])]
+    medidores += [("rpc_pool_utilisation", {"pool": nome}, pool["utilisation"]) for nome, pool in stats["pools"].items()]
+    medidores += [("rpc_cache_hits", {}, stats["cache"]["hits"]), ("rpc_cache_misses", {}, stats["cache"]["misses"]),
+                  ("rpc_cache_hit_rate", {}, stats["cache"]["hit_rate"])]
+    return metricas.texto_prometheus(METRICAS, medidores)
+
+
+async def servir_metricas(reader, writer):
+    """Servidor HTTP mínimo: responde a qualquer GET com as métricas (ex: GET /metrics)."""
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        corpo = texto_metricas().encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     + f"Content-Length: {len(corpo)}\r\n\r\n".encode() + corpo)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
 def list_functions():
     lista = []
     for nome, func in FUNCOES.items():
         assinatura = inspect.signature(func)
-        parametros = list(assinatura.parameters.keys())
+        # Os parâmetros keyword-only (ex: progress) são preenchidos pelo servidor, não pelo cliente
+        parametros = [p.name for p in assinatura.parameters.values() if p.kind != inspect.Parameter.KEYWORD_ONLY]
         doc = inspect.getdoc(func) or "Sem descrição."
         lista.append({
             "name": nome,
@@ -44,22 +481,117 @@ def criar_resposta(id_, result=None, error=None):
     return resp
 
 
+class Ligacao:
+    """Estado de uma ligação de um cliente: os pedidos em execução, por id, para poderem ser cancelados."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        # Protocolo binário se o cliente o tiver negociado no handshake; senão JSON em texto
+        self.binario = getattr(websocket, "subprotocol", None) == protocolo_binario.SUBPROTOCOLO
+        self.trabalhos = {}       # id do pedido -> Task do cálculo
+        self.cancelados = set()   # ids cancelados a pedido do cliente
+        self.em_execucao = 0      # pedidos desta ligação a ser calculados
+        self._tarefas = set()     # uma Task por mensagem recebida
+        self.subscricoes = set()  # (job_id, callback) dos trabalhos subscritos por esta ligação
+
+    def descodificar(self, message):
+        if self.binario:
+            if isinstance(message, str):
+                raise protocolo_binario.ErroProtocolo("esperada uma frame binária")
+            return protocolo_binario.descodificar(message)
+        return json.loads(message)
+
+    def serializar(self, mensagem):
+        if self.binario:
+            return protocolo_binario.codificar(mensagem)
+        return json.dumps(mensagem)
+
+    async def enviar(self, mensagem):
+        await self.websocket.send(self.serializar(mensagem))
+
+    async def notificar(self, mensagem):
+        """Envia uma notificação; se a ligação já tiver fechado, é descartada (ninguém a pode receber)."""
+        try:
+            await self.enviar(mensagem)
+        except websockets.ConnectionClosed:
+            pass
+
+    def lancar(self, coro):
+        tarefa = asyncio.ensure_future(coro)
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    def registar(self, id_, trabalho):
+        if isinstance(id_, (str, int, float)):
+            self.trabalhos[id_] = trabalho
+
+    def remover(self, id_, trabalho):
+        if isinstance(id_, (str, int, float)) and self.trabalhos.get(id_) is trabalho:
+            del self.trabalhos[id_]
+            self.cancelados.discard(id_)
+
+    def foi_cancelado(self, id_):
+        return isinstance(id_, (str, int, float)) and id_ in self.cancelados
+
+    def cancelar(self, id_):
+        """Cancela o pedido com este id. Devolve False se não houver nenhum em execução."""
+        trabalho = self.trabalhos.get(id_) if isinstance(id_, (str, int, float)) else None
+        if trabalho is None or trabalho.done():
+            return False
+        self.cancelados.add(id_)
+        trabalho.cancel()
+        return True
+
+    async def encerrar(self):
+        """Cancela tudo o que ainda estiver a correr para esta ligação e retira as suas subscrições."""
+        for job_id, callback in list(self.subscricoes):
+            TRABALHOS.cancelar_subscricao(job_id, callback)
+        self.subscricoes.clear()
+        for tarefa in list(self._tarefas):
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+
+
+def escolher_subprotocolo(websocket, subprotocolos):
+    """
+    Negociação do handshake: aceita o protocolo binário se o cliente o propuser; os clientes
+    que não proponham nenhum subprotocolo continuam a ser servidos em JSON (em vez de recusados).
+    """
+    if protocolo_binario.SUBPROTOCOLO in subprotocolos:
+        return protocolo_binario.SUBPROTOCOLO
+    return None
+
+
 async def tratar_cliente(websocket):
-    async for message in websocket:
+    ligacao = Ligacao(websocket)
+    try:
+        # Cada mensagem é tratada na sua própria tarefa, para que um pedido demorado não
+        # impeça a leitura das mensagens seguintes (ex: um $/cancelRequest)
+        async for message in websocket:
+            ligacao.lancar(tratar_mensagem(ligacao, message))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        # O cliente desligou-se: devolve o CPU aos restantes clientes
+        await ligacao.encerrar()
+
+
+async def tratar_mensagem(ligacao, message):
+    try:
         try:
-            pedido = json.loads(message)
+            pedido = ligacao.descodificar(message)
 
             # Suporte a batch
             if isinstance(pedido, list):
-                respostas = []
-                for req in pedido:
-                    resp = await processar_pedido(req)
-                    respostas.append(resp)
-                await websocket.send(json.dumps(respostas))
+                respostas = await processar_batch(pedido, ligacao)
+                if respostas is not None:
+                    await ligacao.enviar(respostas)
             else:
-                resposta = await processar_pedido(pedido)
-                await websocket.send(json.dumps(resposta))
+                resposta = await processar_pedido(pedido, ligacao)
+                await ligacao.enviar(resposta)
 
+        except websockets.ConnectionClosed:
+            raise
         except Exception as e:
             # Resposta de erro genérica para pedido inválido
             erro = {
@@ -70,9 +602,80 @@ async def tratar_cliente(websocket):
                 },
                 "id": None
             }
-            await websocket.send(json.dumps(erro))
+            await ligacao.enviar(erro)
+    except websockets.ConnectionClosed:
+        pass  # o cliente desligou-se antes de receber a resposta
+
+def eh_notificacao(pedido):
+    return isinstance(pedido, dict) and "id" not in pedido
+
+
+async def processar_batch(pedidos, ligacao=None):
+    """
+    Executa os pedidos de um batch em simultâneo (no máximo MAX_PARALELISMO_BATCH de cada vez)
+    e devolve as respostas pela ordem original, sem as das notificações.
+    Devolve None se o batch só tiver notificações (nesse caso não se envia nada).
+    """
+    if not pedidos:
+        return criar_resposta(None, error={"code": -32600, "message": "Invalid Request"})
+
+    semaforo = asyncio.Semaphore(MAX_PARALELISMO_BATCH)
+
+    async def processar_com_limite(req):
+        async with semaforo:
+            return await processar_pedido(req, ligacao)
+
+    respostas = await asyncio.gather(*(processar_com_limite(req) for req in pedidos))
+    respostas = [resp for req, resp in zip(pedidos, respostas) if not eh_notificacao(req)]
+    return respostas or None
+
+
+class CanalProgresso:
+    """
+    Envia as notificações de progresso de um pedido pela ligação do cliente. Pode ser chamado
+    a partir das threads de cálculo; as mensagens são enviadas pelo event loop, pela ordem de chegada.
+    """
+
+    def __init__(self, ligacao, id_):
+        self.ligacao = ligacao
+        self.id_ = id_
+        self._loop = asyncio.get_running_loop()
+        self._pendentes = set()
+
+    def __call__(self, dados):
+        self._loop.call_soon_threadsafe(self._enviar, dados)
+
+    def _enviar(self, dados):
+        mensagem = {"jsonrpc": "2.0", "method": "progress", "params": {"id": self.id_, **dados}}
+        envio = asyncio.ensure_future(self.ligacao.notificar(mensagem))
+        self._pendentes.add(envio)
+        envio.add_done_callback(self._pendentes.discard)
+
+    async def esvaziar(self):
+        """Espera que as notificações já emitidas sejam enviadas (antes da resposta final)."""
+        await asyncio.sleep(0)  # deixa correr os _enviar agendados por threads que já terminaram
+        await asyncio.gather(*self._pendentes, return_exceptions=True)
+
+
+async def processar_pedido(pedido, ligacao=None):
+    """Trata um pedido JSON-RPC e regista a sua latência e resultado nas métricas."""
+    inicio = time.perf_counter()
+    METRICAS.em_curso += 1
+    try:
+        resposta = await _processar_pedido(pedido, ligacao)
+    finally:
+        METRICAS.em_curso -= 1
+    method = pedido.get("method") if isinstance(pedido, dict) else None
+    if method not in FUNCOES and method not in METODOS_SERVIDOR:
+        method = "<invalid>"  # não criar uma série por cada nome inválido
+    METRICAS.registar(method, time.perf_counter() - inicio, "error" in resposta)
+    return resposta
+
+
+async def _processar_pedido(pedido, ligacao=None):
+    if not isinstance(pedido, dict):
+        return criar_resposta(None, error={"code": -32600, "message": "Invalid Request"})
 
-async def processar_pedido(pedido):
     jsonrpc = pedido.get("jsonrpc")
     method = pedido.get("method")
     params = pedido.get("params", [])
@@ -88,12 +691,45 @@ async def processar_pedido(pedido):
     try:
         if method == "list_functions":
             resultado = list_functions()
+        elif method == "cache_stats":
+            resultado = CACHE.estatisticas()
+        elif method == "server_stats":
+            resultado = server_stats()
+        elif method == "submit":
+            resultado = submeter_trabalho(*ler_params(params, "method", "params"))
+        elif method == "job_status":
+            resultado = TRABALHOS.estado(*ler_params(params, "job_id"))
+        elif method == "job_result":
+            resultado = TRABALHOS.resultado(*ler_params(params, "job_id"))
+        elif method == "subscribe":
+            if ligacao is None:
+                raise ValueError("subscribe só está disponível através de uma ligação websocket")
+            resultado = subscrever_trabalho(*ler_params(params, "job_id"), ligacao)
+        elif method == "$/cancelRequest":
+            alvo = params.get("id") if isinstance(params, dict) else params[0]
+            resultado = ligacao.cancelar(alvo) if ligacao is not None else False
         elif method in FUNCOES:
-            # Suporta params como dict ou lista
-            if isinstance(params, dict):
-                resultado = FUNCOES[method](**params)
-            else:
-                resultado = FUNCOES[method](*params)
+            if ligacao is not None and ligacao.em_execucao >= MAX_PEDIDOS_POR_LIGACAO:
+                raise admissao.ServidorOcupado("limite de pedidos por ligação atingido")
+            canal = None
+            if pedido.get("stream") is True and ligacao is not None and obter_politica(method)["progresso"]:
+                canal = CanalProgresso(ligacao, id_)
+            trabalho = asyncio.ensure_future(calcular(method, params, progresso=canal))
+            if ligacao is not None:
+                ligacao.registar(id_, trabalho)
+                ligacao.em_execucao += 1
+            try:
+                resultado = await trabalho
+            except asyncio.CancelledError:
+                if ligacao is None or not ligacao.foi_cancelado(id_):
+                    raise
+                return criar_resposta(id_, error={"code": -32800, "message": "Request cancelled"})
+            finally:
+                if ligacao is not None:
+                    ligacao.remover(id_, trabalho)
+                    ligacao.em_execucao -= 1
+                if canal is not None:
+                    await canal.esvaziar()
         else:
             return {
                 "jsonrpc": "2.0",
@@ -110,6 +746,15 @@ async def processar_pedido(pedido):
             "id": id_
         }
 
+    except (admissao.ServidorOcupado, trabalhos.TabelaCheia):
+        return criar_resposta(id_, error={"code": -32000, "message": "Server busy"})
+
+    except trabalhos.TrabalhoDesconhecido:
+        return criar_resposta(id_, error={"code": -32001, "message": "Unknown job"})
+
+    except trabalhos.TrabalhoPorTerminar:
+        return criar_resposta(id_, error={"code": -32002, "message": "Job not finished"})
+
     except Exception as e:
         return {
             "jsonrpc": "2.0",
@@ -118,10 +763,131 @@ async def processar_pedido(pedido):
         }
 
 
-async def main():
-    print(f"Servidor WebSocket a escutar em ws://{HOST}:{PORT}")
-    async with websockets.serve(tratar_cliente, HOST, PORT):
-        await asyncio.Future()  # roda para sempre
+async def main(host=HOST, port=PORT, metrics_port=METRICS_PORT, reuse_port=False, sock=None):
+    """
+    Corre o servidor até receber SIGINT/SIGTERM. Com reuse_port=True, vários processos podem
+    escutar no mesmo host:port (SO_REUSEPORT); com sock, usa um socket já aberto pelo processo pai.
+    """
+    loop = asyncio.get_running_loop()
+    parar = loop.create_future()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sinal, lambda: parar.done() or parar.set_result(None))
+        except (NotImplementedError, RuntimeError):
+            pass  # ex: Windows, ou fora da thread principal
+
+    vigia = None
+    if isinstance(TRABALHOS, trabalhos.TabelaRemota):
+        vigia = asyncio.ensure_future(_vigiar_subscricoes(TRABALHOS))
+
+    servidor_metricas = None
+    if metrics_port is not None:
+        try:
+            servidor_metricas = await asyncio.start_server(servir_metricas, host, metrics_port)
+            print(f"[{os.getpid()}] Métricas em http://{host}:{metrics_port}/metrics")
+        except OSError as e:
+            # As métricas são acessórias: uma porta ocupada não impede o servidor RPC de arrancar
+            print(f"[{os.getpid()}] Métricas desligadas (porta {metrics_port}): {e}")
+    try:
+        if sock is not None:
+            servidor = websockets.serve(tratar_cliente, sock=sock, select_subprotocol=escolher_subprotocolo)
+        else:
+            servidor = websockets.serve(tratar_cliente, host, port, reuse_port=reuse_port,
+                                        select_subprotocol=escolher_subprotocolo)
+        async with servidor:
+            print(f"[{os.getpid()}] Servidor WebSocket a escutar em ws://{host}:{port}")
+            await parar  # ao sair do bloco, as ligações abertas são fechadas de forma ordenada
+    finally:
+        if vigia is not None:
+            vigia.cancel()
+        if servidor_metricas is not None:
+            servidor_metricas.close()
+        for tarefa in list(_tarefas_trabalhos):
+            tarefa.cancel()
+        encerrar_executores()
+
+
+async def _vigiar_subscricoes(tabela):
+    # Um trabalho subscrito nesta ligação pode estar a correr noutro worker, que não avisa este processo
+    while True:
+        await asyncio.sleep(INTERVALO_SUBSCRICOES)
+        tabela.verificar_subscricoes()
+
+
+def _worker_servidor(config, sock=None):
+    """
+    Processo worker do modo multi-processo: divide o orçamento de CPU com os restantes workers e usa
+    a tabela de trabalhos e os checkpoints do crack_key do processo pai, comuns a todos os workers.
+    """
+    global ADMISSAO, MAX_PROCESSOS, TRABALHOS
+    MAX_PROCESSOS = config["slots_cpu"]
+    ADMISSAO = admissao.ControloAdmissao(config["slots_cpu"], MAX_FILA)
+    TRABALHOS, criptografia.CHECKPOINTS = estado_partilhado.ligar(*config["estado"])
+    asyncio.run(main(config["host"], config["port"], config["metrics_port"], reuse_port=sock is None, sock=sock))
+
+
+def lancar_workers(n_workers, host=HOST, port=PORT, metrics_port=METRICS_PORT, timeout_paragem=10.0):
+    """
+    Lança n_workers processos do servidor no mesmo host:port e espera que terminem.
+    Usa SO_REUSEPORT (o kernel distribui as ligações pelos processos); onde não existe, o pai abre
+    o socket e os workers partilham-no (pre-fork). SIGINT/SIGTERM no pai param todos os workers de
+    forma ordenada; os que não terminarem em timeout_paragem segundos são mortos.
+    Cada worker expõe as suas métricas em metrics_port + índice do worker.
+    A tabela de trabalhos (submit/job_status/...) e os checkpoints do crack_key ficam neste processo e
+    são partilhados por todos os workers: um trabalho submetido num pode ser consultado noutro.
+    """
+    sock = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sock = socket.create_server((host, port))
+        sock.set_inheritable(True)
+
+    estado = estado_partilhado.servir(TRABALHOS, criptografia.CHECKPOINTS)
+    contexto = multiprocessing.get_context("spawn")
+    processos = []
+    for i in range(n_workers):
+        config = {
+            "host": host,
+            "port": port,
+            "metrics_port": metrics_port + i if metrics_port is not None else None,
+            "slots_cpu": max(1, SLOTS_CPU // n_workers),
+            "estado": estado,
+        }
+        p = contexto.Process(target=_worker_servidor, args=(config, sock), name=f"servidor-rpc-{i}")
+        p.start()
+        processos.append(p)
+
+    prazo = []  # instante a partir do qual os workers que ainda não pararam são mortos
+
+    def parar(sinal, frame):
+        if not prazo:
+            prazo.append(time.monotonic() + timeout_paragem)
+        for p in processos:
+            if p.is_alive():
+                p.terminate()  # SIGTERM: o worker fecha as ligações e termina
+
+    signal.signal(signal.SIGINT, parar)
+    signal.signal(signal.SIGTERM, parar)
+    while any(p.is_alive() for p in processos):
+        for p in processos:
+            p.join(0.2)
+            if prazo and time.monotonic() > prazo[0] and p.is_alive():
+                p.kill()
+    if sock is not None:
+        sock.close()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Servidor JSON-RPC sobre WebSocket")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="número de processos servidor a partilhar a mesma porta")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="porta HTTP das métricas (por omissão desligadas; 0 também desliga)")
+    args = parser.parse_args()
+    metrics_port = args.metrics_port or None
+
+    if args.workers > 1:
+        lancar_workers(args.workers, args.host, args.port, metrics_port)
+    else:
+        asyncio.run(main(args.host, args.port, metrics_port))
@@ -0,0 +1,141 @@
+## Tabela de primos pequenos em memória partilhada, construída uma vez e usada por todos os workers
+import atexit
+import bisect
+import itertools
+import math
+import threading
+from array import array
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import divisao
+
+np = divisao.np  # NumPy é opcional, como no kernel de divisão
+
+# Primos até 2^25 (~2 milhões, 8 MB): chegam para testar por divisão números até 2^50 (> 10^15)
+LIMITE_PADRAO = 1 << 25
+
+_propria = {}   # limite -> tabela construída por este processo (é este processo que a apaga)
+_anexadas = {}  # nome do segmento -> tabela anexada a partir de um descritor
+_atual = None   # última tabela construída ou anexada neste processo
+_lock = threading.Lock()  # workers em threads podem pedir a tabela ao mesmo tempo
+
+
+def _crivo(limite: int):
+    """Primos abaixo de limite (crivo de Eratóstenes só com ímpares: o índice i representa 2i + 1)."""
+    crivo = bytearray([1]) * (limite // 2)
+    crivo[0] = 0  # 1 não é primo
+    for i in range(1, (math.isqrt(limite - 1) >> 1) + 1):
+        if crivo[i]:
+            p = 2 * i + 1
+            inicio = p * p // 2
+            crivo[inicio::p] = bytes(len(range(inicio, limite // 2, p)))
+    if np is not None:
+        impares = np.flatnonzero(np.frombuffer(crivo, dtype=np.uint8)) * 2 + 1
+        return np.concatenate(([2], impares)).astype(np.uint32) if limite > 2 else impares.astype(np.uint32)
+    primos = array("I", [2] if limite > 2 else [])
+    primos.extend(itertools.compress(range(1, limite, 2), crivo))
+    return primos
+
+
+class TabelaPrimos:
+    """
+    Primos abaixo de limite, guardados como uint32 num segmento de multiprocessing.shared_memory.
+    O processo pai constrói a tabela com criar() e passa o descritor aos workers, que a anexam
+    com anexar() sem copiar nada. primos é um array NumPy (ou memoryview, sem NumPy) sobre o segmento.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, quantidade: int, limite: int, dono: bool):
+        self.shm = shm
+        self.quantidade = quantidade
+        self.limite = limite
+        self.dono = dono
+        if np is not None:
+            self.primos = np.ndarray((quantidade,), dtype=np.uint32, buffer=shm.buf)
+        else:
+            self.primos = shm.buf.cast("I")[:quantidade]
+
+    @classmethod
+    def criar(cls, limite: int = LIMITE_PADRAO) -> "TabelaPrimos":
+        primos = _crivo(limite)
+        quantidade = len(primos)
+        shm = shared_memory.SharedMemory(create=True, size=max(4 * quantidade, 1))
+        tabela = cls(shm, quantidade, limite, dono=True)
+        tabela.primos[:] = primos
+        return tabela
+
+    @classmethod
+    def anexar(cls, descritor: Tuple[str, int, int]) -> "TabelaPrimos":
+        nome, quantidade, limite = descritor
+        try:
+            shm = shared_memory.SharedMemory(name=nome, track=False)  # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=nome)
+        return cls(shm, quantidade, limite, dono=False)
+
+    @property
+    def descritor(self) -> Tuple[str, int, int]:
+        """O que um worker precisa para anexar a tabela (pode ser enviado por pickle)."""
+        return self.shm.name, self.quantidade, self.limite
+
+    def cobre(self, n: int) -> bool:
+        """True se a tabela tem todos os primos até √n (chega para testar n por divisão)."""
+        return n < self.limite * self.limite
+
+    def fechar(self):
+        self.primos = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # ainda há vistas sobre o segmento neste processo; é libertado quando o processo terminar
+        if self.dono:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def obter_tabela(limite: int = LIMITE_PADRAO) -> TabelaPrimos:
+    """Tabela deste processo com pelo menos limite; é construída na primeira chamada e apagada à saída."""
+    global _atual
+    with _lock:
+        for existente, tabela in _propria.items():
+            if existente >= limite:
+                _atual = tabela
+                return tabela
+        tabela = TabelaPrimos.criar(limite)
+        _propria[limite] = tabela
+        atexit.register(tabela.fechar)
+        _atual = tabela
+        return tabela
+
+
+def anexar_tabela(descritor: Optional[Tuple[str, int, int]]) -> Optional[TabelaPrimos]:
+    """Anexa (uma vez por processo) a tabela de outro processo. Serve de initializer de pools de processos."""
+    global _atual
+    if descritor is None:
+        return None
+    with _lock:
+        for tabela in _propria.values():
+            if tabela.descritor == tuple(descritor):
+                return tabela  # worker criado por fork (ou thread deste processo): já tem a tabela
+        tabela = _anexadas.get(descritor[0])
+        if tabela is None:
+            tabela = _anexadas[descritor[0]] = TabelaPrimos.anexar(descritor)
+        _atual = tabela
+        return tabela
+
+
+def tabela_atual() -> Optional[TabelaPrimos]:
+    """A tabela já disponível neste processo (construída ou anexada), ou None."""
+    return _atual
+
+
+def primos_ate(limite: int):
+    """Primos abaixo de limite: uma fatia (sem cópia) da tabela deste processo, se a cobrir; senão um crivo novo."""
+    tabela = _atual
+    if tabela is None or limite > tabela.limite:
+        return _crivo(limite)
+    if np is not None and isinstance(tabela.primos, np.ndarray):
+        return tabela.primos[:int(np.searchsorted(tabela.primos, limite))]
+    return tabela.primos[:bisect.bisect_left(tabela.primos, limite)]
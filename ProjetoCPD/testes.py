@@ -1,8 +1,38 @@
+import math
 import unittest
 from calculo import is_prime, find_max_prime_sequential, find_max_prime_parallel, find_next_twin_primes
 from calculo import is_mersenne_prime, prime_factors, next_prime, previous_prime
-from criptografia import generate_keys, encrypt, decrypt, crack_key
+from criptografia import generate_keys, encrypt, decrypt, crack_key, ArmazemCheckpoints, CHECKPOINTS
+import admissao
+import asyncio
+import autotune
+import cache_rpc
+import calculo
+import coordenador
+import divisao
+import execucao
+import gerador_carga
+import metricas
+import protocolo_binario
+import servidor_rpc
+import tabela_primos
+import trabalhos
+import websockets
+from cliente_rpc import RPCClientWS
+import contextlib
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
 import time
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
 
 
 class C1Test1IsPrime(unittest.TestCase):
@@ -254,6 +284,231 @@ class C1Test8PreviousPrime(unittest.TestCase):
         self.assertEqual(previous_prime(3), 2)
 
 
+class C1Test9KernelDivisao(unittest.TestCase):
+
+    def _menor_divisor_lento(self, n, inicio, fim):
+        for d in range(max(inicio, 2), fim):
+            if math.gcd(d, 30) == 1 and n % d == 0:
+                return d
+        return None
+
+    def _compara_com_referencia(self):
+        random.seed(1234)
+        for _ in range(50):
+            n = random.randrange(2, 10**12)
+            inicio = random.randrange(0, 5000)
+            fim = inicio + random.randrange(0, 5000)
+            with self.subTest(n=n, inicio=inicio, fim=fim):
+                self.assertEqual(divisao.menor_divisor(n, inicio, fim), self._menor_divisor_lento(n, inicio, fim))
+
+    def test_kernel_igual_a_referencia(self):
+        """O kernel (NumPy, se existir) devolve o mesmo que uma procura linear."""
+        self._compara_com_referencia()
+
+    def test_fallback_python_igual_a_referencia(self):
+        """Sem NumPy, o ciclo em Python sobre a roda dá os mesmos resultados."""
+        with mock.patch.object(divisao, "np", None):
+            self._compara_com_referencia()
+
+    @unittest.skipIf(divisao.np is None, "NumPy não instalado")
+    def test_reducao_multi_limb(self):
+        """Para n >= 2^63, a redução por limbs de 32 bits encontra o fator correto."""
+        p = next_prime(1_000_003)
+        n = p * (2**89 - 1)  # 2^89 - 1 é primo
+        self.assertGreaterEqual(n, 2**63)
+        self.assertEqual(divisao.menor_divisor(n, 7, 2_000_000), p)
+        self.assertIsNone(divisao.menor_divisor(n, p + 1, 2_000_000))
+
+    def test_prime_factors_com_fatores_grandes(self):
+        """prime_factors decompõe números com fatores primos acima de um bloco do kernel."""
+        p = next_prime(3_000_000)
+        q = next_prime(p)
+        self.assertEqual(prime_factors(2 * 7 * p * q), [2, 7, p, q])
+        self.assertEqual(prime_factors(p ** 3), [p, p, p])
+
+
+class C1Test10TabelaPrimos(unittest.TestCase):
+
+    def test_tabela_tem_os_primos_e_e_partilhada_sem_copia(self):
+        """A tabela tem exatamente os primos abaixo do limite; quem a anexa vê a mesma memória."""
+        tabela = tabela_primos.TabelaPrimos.criar(10_000)
+        anexada = tabela_primos.TabelaPrimos.anexar(tabela.descritor)
+        try:
+            self.assertEqual([int(p) for p in tabela.primos], [n for n in range(10_000) if is_prime(n)])
+            self.assertEqual(list(anexada.primos), list(tabela.primos))
+            tabela.primos[0] = 3  # escrita visível do outro lado: é o mesmo segmento
+            self.assertEqual(anexada.primos[0], 3)
+        finally:
+            anexada.fechar()
+            tabela.fechar()
+
+    def test_threads_partilham_uma_unica_tabela(self):
+        """Várias threads a pedir a tabela ao mesmo tempo constroem-na uma só vez (sem segmentos perdidos)."""
+        criar = tabela_primos.TabelaPrimos.criar
+        criadas = []
+
+        def criar_devagar(limite):
+            time.sleep(0.05)  # alarga a janela em que outra thread podia começar a construir a sua
+            criadas.append(criar(limite))
+            return criadas[-1]
+
+        obtidas = []
+        with mock.patch.dict(tabela_primos._propria, clear=True), \
+                mock.patch.object(tabela_primos, "_atual", None), \
+                mock.patch.object(tabela_primos.TabelaPrimos, "criar", side_effect=criar_devagar):
+            threads = [threading.Thread(target=lambda: obtidas.append(tabela_primos.obter_tabela(1 << 12)))
+                       for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        for tabela in criadas:
+            tabela.fechar()
+        self.assertEqual(len(criadas), 1)
+        self.assertTrue(all(tabela is criadas[0] for tabela in obtidas))
+
+    def test_divisao_so_por_primos_da_tabela(self):
+        """is_prime, menor_divisor e a fatorização dão os mesmos resultados usando só os primos da tabela."""
+        tabela = tabela_primos.TabelaPrimos.criar(1 << 16)
+        try:
+            random.seed(42)
+            for _ in range(200):
+                n = random.randrange(0, 1 << 32)
+                with self.subTest(n=n):
+                    self.assertEqual(calculo._is_prime_tabela(n, tabela), is_prime(n))
+                    self.assertEqual(divisao.fatores_primos(n, tabela), divisao.fatores_primos(n))
+            p, q = next_prime(40_000), next_prime(50_000)
+            self.assertEqual(divisao.menor_divisor(p * q, 7, 1 << 16, tabela.primos), p)
+            self.assertIsNone(divisao.menor_divisor(p * q, p + 1, q, tabela.primos))
+        finally:
+            tabela.fechar()
+
+
+class C1Test11FatorizacaoEmLote(unittest.TestCase):
+
+    def _listas(self, fatores, offsets):
+        return [list(fatores[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+    def test_intervalo_com_tabela_spf(self):
+        """prime_factors_range dá, número a número, o mesmo que prime_factors (incluindo 0 e 1)."""
+        self.assertEqual(self._listas(*calculo.prime_factors_range(0, 3000)),
+                         [prime_factors(n) for n in range(0, 3000)])
+        self.assertEqual(self._listas(*calculo.prime_factors_range(5, 5)), [])
+
+    def test_intervalo_com_crivo_segmentado(self):
+        """Acima de LIMITE_SPF, o crivo segmentado (com ou sem NumPy) dá os mesmos fatores."""
+        intervalos = [(0, 3000), (990, 1010), (10**9, 10**9 + 2000)]
+        with mock.patch.object(calculo, "LIMITE_SPF", 1000), mock.patch.object(calculo, "TAMANHO_SEGMENTO", 777):
+            for np in ([divisao.np, None] if divisao.np is not None else [None]):
+                with mock.patch.object(divisao, "np", np):
+                    for lo, hi in intervalos:
+                        with self.subTest(lo=lo, hi=hi, numpy=np is not None):
+                            self.assertEqual(self._listas(*calculo.prime_factors_range(lo, hi)),
+                                             [prime_factors(n) for n in range(lo, hi)])
+
+    def test_primos_base_calculados_uma_vez_por_intervalo(self):
+        """Os primos até √hi são obtidos uma só vez por chamada, e não uma vez por segmento."""
+        with mock.patch.object(calculo, "TAMANHO_SEGMENTO", 777), \
+                mock.patch.object(tabela_primos, "primos_ate", wraps=tabela_primos.primos_ate) as primos_ate:
+            calculo.prime_factors_range(10**9, 10**9 + 5000)
+            self.assertEqual(primos_ate.call_count, 1)
+            list(calculo.iter_prime_factors_range(10**9, 10**9 + 5000, tamanho_segmento=777))
+            self.assertEqual(primos_ate.call_count, 2)
+
+    def test_iterador_e_valores_soltos(self):
+        """O iterador gera (n, fatores) por ordem e prime_factors_many aceita valores quaisquer até 2^64."""
+        self.assertEqual(list(calculo.iter_prime_factors_range(95, 103, tamanho_segmento=3)),
+                         [(n, prime_factors(n)) for n in range(95, 103)])
+        valores = [0, 1, -12, 97, 2**61 - 1, 10**7 + 19, 600851475143]
+        self.assertEqual(self._listas(*calculo.prime_factors_many(valores)), [prime_factors(v) for v in valores])
+        with self.assertRaises(ValueError):
+            calculo.prime_factors_many([2**64])
+
+
+class C1Test12Autotune(unittest.TestCase):
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        for patcher in (mock.patch.object(autotune, "FICHEIRO_CACHE", os.path.join(pasta.name, "autotune.json")),
+                        mock.patch.object(autotune, "_calibracao", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_calibracao_medida_uma_vez_e_guardada_por_maquina(self):
+        """A calibração pedida (python autotune.py) é medida uma vez e depois vem do ficheiro de cache."""
+        with mock.patch.object(autotune, "_candidatos_workers", return_value=[1, 2]):
+            calibracao = autotune.calibrar(duracao=0.05)
+        self.assertEqual(set(calibracao["workers"]), {"1", "2"})
+        self.assertIn(calibracao["block"], autotune.BLOCOS_CANDIDATOS)
+
+        with mock.patch.object(autotune, "calibrar", return_value=calibracao) as calibrar:
+            autotune.obter_calibracao()
+            autotune._calibracao = None  # como num processo novo
+            self.assertEqual(autotune.obter_calibracao(), calibracao)
+            self.assertEqual(calibrar.call_count, 1)
+        with open(autotune.FICHEIRO_CACHE, encoding="utf-8") as f:
+            self.assertIn(autotune.chave_maquina(), json.load(f))
+
+    def test_sem_calibracao_nao_mede_nada(self):
+        """Sem calibração guardada, as escolhas usam o número de CPUs e o bloco fixo, sem lançar medições."""
+        with mock.patch.object(autotune, "calibrar") as calibrar:
+            self.assertEqual(autotune.melhor_n_workers(5), os.cpu_count() or 1)
+            self.assertIsNone(autotune.melhor_tamanho_bloco())
+            n = 1000003 * 999983
+            self.assertEqual(crack_key(n, 7, timeout=20, resume=False, n_workers=None)[0], n)
+        calibrar.assert_not_called()
+
+    def test_escolha_depende_do_timeout(self):
+        """Com timeouts curtos, o arranque de muitos workers não compensa; com timeouts longos, compensa."""
+        workers = {"1": {"startup": 0.1, "rate": 100.0}, "8": {"startup": 2.0, "rate": 700.0}}
+        self.assertEqual(autotune._escolher_workers(workers, 1), 1)
+        self.assertEqual(autotune._escolher_workers(workers, 10), 8)
+        # Diferenças dentro do ruído da medição ficam com menos workers
+        self.assertEqual(autotune._escolher_workers({"1": {"startup": 0.1, "rate": 100.0},
+                                                     "2": {"startup": 0.1, "rate": 102.0}}, 5), 1)
+
+    def test_n_workers_none_usa_a_calibracao(self):
+        """find_max_prime_parallel(n_workers=None) usa o número de workers escolhido pelo autotune."""
+        with mock.patch.object(autotune, "melhor_n_workers", return_value=2) as melhor:
+            self.assertTrue(is_prime(find_max_prime_parallel(1, None)))
+        melhor.assert_called_once_with(1)
+
+
+class C1Test13BackendExecucao(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(execucao, "_backend_global", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_escolha_do_backend(self):
+        """Threads só por omissão quando não há GIL; a escolha por chamada prevalece sobre a global."""
+        with mock.patch.object(execucao, "gil_ativo", return_value=True):
+            self.assertEqual(execucao.escolher_backend(), "process")
+        with mock.patch.object(execucao, "gil_ativo", return_value=False):
+            self.assertEqual(execucao.escolher_backend(), "thread")
+            execucao.definir_backend("process")
+            self.assertEqual(execucao.escolher_backend(), "process")
+            self.assertEqual(execucao.escolher_backend("thread"), "thread")
+        with self.assertRaises(ValueError):
+            execucao.definir_backend("gpu")
+        with self.assertRaises(ValueError):
+            find_max_prime_parallel(1, 2, backend="gpu")
+
+    def test_workers_em_threads(self):
+        """Com backend="thread", os workers partilham o estado em memória e dão os mesmos resultados."""
+        eventos = []
+        primo = find_max_prime_parallel(1, 2, progress=eventos.append, backend="thread")
+        self.assertTrue(is_prime(primo))
+        self.assertGreater(primo, 10**15)
+        self.assertGreater(eventos[-1]["scanned"], 0)
+
+        n = 1000003 * 999983
+        self.assertEqual(crack_key(n, 7, timeout=20, resume=False, backend="thread"),
+                         crack_key(n, 7, timeout=20, resume=False, backend="process"))
+
+
 class C2Test1GenerateKeysBits(unittest.TestCase):
 
     def test_chaves_8_bits(self):
@@ -487,5 +742,1074 @@ class C2Test4CrackKey(unittest.TestCase):
                     self.fail(f"Não foi possível quebrar a chave de {bits} bits dentro de {tempo} segundos.")
 
 
+class C2Test5CrackKeyCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        """Chave com um fator primo afastado de 3, para que a posição de partida faça diferença."""
+        self.p = next_prime(2_000_000)
+        self.q = next_prime(self.p + 1000)
+        self.n = self.p * self.q
+        CHECKPOINTS.remover(self.n)
+
+    def tearDown(self):
+        CHECKPOINTS.remover(self.n)
+
+    def test_timeout_guarda_checkpoint(self):
+        """Um timeout deve deixar registado até onde a procura chegou."""
+        public_key, _ = generate_keys(64)
+        n, e = public_key
+        with self.assertRaises(TimeoutError):
+            crack_key(n, e, timeout=1)
+        checkpoint = CHECKPOINTS.obter(n)
+        CHECKPOINTS.remover(n)
+        self.assertIsNotNone(checkpoint)
+        self.assertGreater(checkpoint["proximo_divisor"], 3)
+        self.assertGreater(checkpoint["tempo"], 0)
+
+    def test_retoma_a_partir_do_checkpoint(self):
+        """Com um checkpoint perto do fator, a quebra continua a partir daí e limpa o checkpoint."""
+        CHECKPOINTS.guardar(self.n, {"proximo_divisor": self.p - 100, "tempo": 0.0})
+        n_crack, d_crack = crack_key(self.n, 65537, timeout=10)
+        self.assertEqual(n_crack, self.n)
+        self.assertEqual((65537 * d_crack) % ((self.p - 1) * (self.q - 1)), 1)
+        self.assertIsNone(CHECKPOINTS.obter(self.n))
+
+    def test_resume_false_ignora_checkpoint(self):
+        """Um checkpoint para lá do fator impede a quebra, a não ser que resume=False."""
+        CHECKPOINTS.guardar(self.n, {"proximo_divisor": self.p + 2, "tempo": 0.0})
+        with self.assertRaises(TimeoutError):
+            crack_key(self.n, 65537, timeout=10)
+        n_crack, _ = crack_key(self.n, 65537, timeout=10, resume=False)
+        self.assertEqual(n_crack, self.n)
+
+    def test_armazem_persistido_em_ficheiro(self):
+        """Os checkpoints guardados em ficheiro são lidos por uma nova instância do armazém."""
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, "checkpoints.json")
+            ArmazemCheckpoints(caminho).guardar(self.n, {"proximo_divisor": 1001, "tempo": 1.5})
+            self.assertEqual(ArmazemCheckpoints(caminho).obter(self.n), {"proximo_divisor": 1001, "tempo": 1.5})
+
+    def test_armazem_limitado_e_com_expiracao(self):
+        """O armazém guarda no máximo max_checkpoints (sai o usado há mais tempo) e esquece os antigos."""
+        armazem = ArmazemCheckpoints(max_checkpoints=2)
+        armazem.guardar(15, {"proximo_divisor": 3})
+        armazem.guardar(21, {"proximo_divisor": 3})
+        armazem.obter(15)
+        armazem.guardar(35, {"proximo_divisor": 3})
+        self.assertIsNone(armazem.obter(21))
+        self.assertEqual(armazem.obter(15), {"proximo_divisor": 3})
+
+        armazem = ArmazemCheckpoints(retencao=60)
+        armazem.guardar(15, {"proximo_divisor": 3})
+        with mock.patch("criptografia.time.time", return_value=time.time() + 61):
+            self.assertIsNone(armazem.obter(15))
+
+
+class C3Test1ServidorExecucao(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def _pedido(self, method, params, id_=1):
+        return {"jsonrpc": "2.0", "method": method, "params": params, "id": id_}
+
+    def test_politicas_por_metodo(self):
+        """Métodos baratos correm inline e os restantes usam o pool de processos por omissão."""
+        self.assertEqual(servidor_rpc.obter_politica("mdc")["execucao"], "inline")
+        self.assertEqual(servidor_rpc.obter_politica("crack_key")["execucao"], "thread")
+        self.assertEqual(servidor_rpc.obter_politica("prime_factors")["execucao"], "process")
+
+    def test_parametros_internos_nao_vem_do_cliente(self):
+        """progress, cancel e backend (keyword-only) não podem ser passados por um cliente."""
+        params = {"n": 143, "e": 7, "timeout": 5, "backend": "gpu", "progress": "x", "cancel": 1}
+        self.assertEqual(servidor_rpc.parametros_cliente("crack_key", params), {"n": 143, "e": 7, "timeout": 5})
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("crack_key", params)))
+        self.assertEqual(resposta["result"][0], 143)
+
+    def test_is_prime_so_corre_inline_para_n_pequeno(self):
+        """is_prime é O(√n): números grandes vão para o pool em vez de bloquearem o event loop."""
+        politica = servidor_rpc.obter_politica("is_prime")
+        self.assertEqual(servidor_rpc.modo_execucao("is_prime", [97], politica), "inline")
+        self.assertEqual(servidor_rpc.modo_execucao("is_prime", {"n": -97}, politica), "inline")
+        self.assertEqual(servidor_rpc.modo_execucao("is_prime", [10**18 + 3], politica), "process")
+        self.assertEqual(servidor_rpc.modo_execucao("is_prime", ["x"], politica), "process")
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("is_prime", [10**12 + 39])))
+        self.assertTrue(resposta["result"])
+
+    def test_pool_partido_e_encerrado_e_substituido(self):
+        """Se o pool de processos partir, é encerrado e o pedido seguinte usa um pool novo."""
+        partido = mock.Mock()
+        partido.submit.side_effect = BrokenProcessPool("worker morreu")
+        servidor_rpc._executores["process"] = partido
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("prime_factors", [360])))
+        self.assertIn("error", resposta)
+        partido.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertNotIn("process", servidor_rpc._executores)
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("prime_factors", [360])))
+        self.assertEqual(resposta["result"], [2, 2, 2, 3, 3, 5])
+
+    def test_resultado_vindo_do_pool_de_processos(self):
+        """Um método em modo "process" devolve o mesmo resultado que a chamada local."""
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("prime_factors", [360])))
+        self.assertEqual(resposta["result"], [2, 2, 2, 3, 3, 5])
+
+    def test_pedido_lento_nao_bloqueia_o_event_loop(self):
+        """Um is_prime enviado durante um find_max_prime_sequential(2) responde sem esperar por ele."""
+        async def cenario():
+            lento = asyncio.create_task(servidor_rpc.processar_pedido(
+                self._pedido("find_max_prime_sequential", {"timeout": 2}, id_=1)))
+            await asyncio.sleep(0.2)
+            inicio = time.perf_counter()
+            rapido = await servidor_rpc.processar_pedido(self._pedido("is_prime", [97], id_=2))
+            duracao = time.perf_counter() - inicio
+            self.assertTrue(rapido["result"])
+            self.assertFalse(lento.done())
+            await lento
+            return duracao
+
+        self.assertLess(asyncio.run(cenario()), 0.5)
+
+    def test_fatorizacao_em_lote_pelo_servidor(self):
+        """prime_factors_range devolve os arrays CSR como listas JSON; o iterador não é exposto."""
+        resposta = asyncio.run(servidor_rpc.processar_pedido(self._pedido("prime_factors_range", [10, 13])))
+        self.assertEqual(resposta["result"], [[2, 5, 11, 2, 2, 3], [0, 2, 3, 6]])
+        json.dumps(resposta)
+        self.assertNotIn("iter_prime_factors_range", servidor_rpc.FUNCOES)
+        grande = asyncio.run(servidor_rpc.processar_pedido(
+            self._pedido("prime_factors_range", [0, servidor_rpc.MAX_INTERVALO_FATORIZACAO + 1])))
+        self.assertIn("no máximo", grande["error"]["message"])
+
+
+class C3Test2ServidorBatch(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_respostas_pela_ordem_original(self):
+        """As respostas do batch vêm pela ordem dos pedidos, mesmo executados em simultâneo."""
+        pedidos = [{"jsonrpc": "2.0", "method": "next_prime", "params": [n], "id": n} for n in [100, 10, 1000, 1]]
+        respostas = asyncio.run(servidor_rpc.processar_batch(pedidos))
+        self.assertEqual([r["id"] for r in respostas], [100, 10, 1000, 1])
+        self.assertEqual([r["result"] for r in respostas], [101, 11, 1009, 2])
+
+    def test_pedidos_executados_em_simultaneo(self):
+        """Quatro pedidos de 1s numa thread demoram bem menos do que 4s no total."""
+        pedidos = [{"jsonrpc": "2.0", "method": "crack_key", "params": [n, 5, 1], "id": i}
+                   for i, n in enumerate([221, 143, 323, 437])]
+        with mock.patch.dict(servidor_rpc.FUNCOES, {"crack_key": lambda n, e, timeout, *, cancel=None: time.sleep(timeout) or n}), \
+                mock.patch.object(servidor_rpc, "ADMISSAO", admissao.ControloAdmissao(16, servidor_rpc.MAX_FILA)):
+            inicio = time.perf_counter()
+            respostas = asyncio.run(servidor_rpc.processar_batch(pedidos))
+            duracao = time.perf_counter() - inicio
+        self.assertEqual([r["result"] for r in respostas], [221, 143, 323, 437])
+        self.assertLess(duracao, 2)
+
+    def test_notificacoes_sem_resposta(self):
+        """Pedidos sem id são executados mas não aparecem nas respostas."""
+        pedidos = [{"jsonrpc": "2.0", "method": "is_prime", "params": [7]},
+                   {"jsonrpc": "2.0", "method": "is_prime", "params": [8], "id": "a"}]
+        respostas = asyncio.run(servidor_rpc.processar_batch(pedidos))
+        self.assertEqual(respostas, [{"jsonrpc": "2.0", "result": False, "id": "a"}])
+        self.assertIsNone(asyncio.run(servidor_rpc.processar_batch(pedidos[:1])))
+
+    def test_batch_vazio_e_elementos_invalidos(self):
+        """Um batch vazio é um único erro; elementos inválidos dão um erro cada."""
+        vazio = asyncio.run(servidor_rpc.processar_batch([]))
+        self.assertEqual(vazio["error"]["code"], -32600)
+        respostas = asyncio.run(servidor_rpc.processar_batch([1, {"jsonrpc": "2.0", "method": "is_prime", "params": [7], "id": 1}]))
+        self.assertEqual(respostas[0]["error"]["code"], -32600)
+        self.assertTrue(respostas[1]["result"])
+
+
+class C3Test3ServidorCache(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(servidor_rpc, "CACHE", cache_rpc.CacheResultados())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def _chamar(self, method, params):
+        pedido = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        return asyncio.run(servidor_rpc.processar_pedido(pedido))
+
+    def test_parametros_normalizados_partilham_entrada(self):
+        """is_prime([97]) e is_prime({"n": 97}) dão um miss seguido de um hit."""
+        self.assertTrue(self._chamar("is_prime", [97])["result"])
+        self.assertTrue(self._chamar("is_prime", {"n": 97})["result"])
+        stats = self._chamar("cache_stats", [])["result"]
+        self.assertEqual((stats["misses"], stats["hits"], stats["entries"]), (1, 1, 1))
+
+    def test_metodos_aleatorios_nao_sao_guardados(self):
+        """generate_keys nunca passa pela cache."""
+        self._chamar("generate_keys", [16])
+        self._chamar("generate_keys", [16])
+        stats = servidor_rpc.CACHE.estatisticas()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (0, 0, 0))
+
+    def test_lru_e_limite_de_memoria(self):
+        """A entrada menos usada é a primeira a sair quando se excede o número de entradas ou bytes."""
+        cache = cache_rpc.CacheResultados(max_entradas=2)
+        cache.guardar("a", 1)
+        cache.guardar("b", 2)
+        cache.obter("a")
+        cache.guardar("c", 3)
+        self.assertEqual(cache.obter("b"), (False, None))
+        self.assertEqual(cache.obter("a"), (True, 1))
+        self.assertEqual(cache.estatisticas()["evictions"], 1)
+
+        cache = cache_rpc.CacheResultados(max_bytes=10)
+        cache.guardar("grande", list(range(100)))
+        self.assertEqual(cache.estatisticas()["entries"], 0)
+
+    def test_ttl_expira_entrada(self):
+        """Uma entrada com TTL deixa de ser devolvida depois de expirar."""
+        cache = cache_rpc.CacheResultados()
+        cache.guardar("x", 42, ttl=0.05)
+        self.assertEqual(cache.obter("x"), (True, 42))
+        time.sleep(0.1)
+        self.assertEqual(cache.obter("x"), (False, None))
+
+
+
+class C3Test4ServidorCoalescencia(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(servidor_rpc, "CACHE", cache_rpc.CacheResultados())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.chamadas = 0
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def _crack_lento(self, n, e, timeout=15, resume=True, *, cancel=None):
+        self.chamadas += 1
+        time.sleep(0.5)
+        if n == 0:
+            raise ValueError("n inválido")
+        return n, e
+
+    def _pedidos_simultaneos(self, params_lista):
+        async def cenario():
+            pedidos = [{"jsonrpc": "2.0", "method": "crack_key", "params": params, "id": i}
+                       for i, params in enumerate(params_lista)]
+            return await asyncio.gather(*(servidor_rpc.processar_pedido(p) for p in pedidos))
+
+        with mock.patch.dict(servidor_rpc.FUNCOES, {"crack_key": self._crack_lento}):
+            return asyncio.run(cenario())
+
+    def test_pedidos_iguais_partilham_execucao(self):
+        """Três crack_key iguais (posicionais e nomeados) em simultâneo executam a função uma só vez."""
+        respostas = self._pedidos_simultaneos([[221, 5], [221, 5, 15], {"n": 221, "e": 5}])
+        self.assertEqual(self.chamadas, 1)
+        self.assertEqual([r["result"] for r in respostas], [[221, 5]] * 3)
+        self.assertEqual(servidor_rpc._em_curso, {})
+
+    def test_erro_partilhado_por_todos(self):
+        """Se a execução partilhada falhar, todos os pedidos recebem o erro."""
+        respostas = self._pedidos_simultaneos([[0, 5], [0, 5]])
+        self.assertEqual(self.chamadas, 1)
+        self.assertEqual([r["error"]["message"] for r in respostas], ["n inválido"] * 2)
+
+    def test_parametros_diferentes_nao_partilham(self):
+        """Pedidos com parâmetros diferentes continuam a ter execuções separadas."""
+        self._pedidos_simultaneos([[221, 5], [143, 7]])
+        self.assertEqual(self.chamadas, 2)
+
+    def test_metodos_aleatorios_nao_partilham(self):
+        """generate_keys nunca é coalescido."""
+        self.assertFalse(servidor_rpc.obter_politica("generate_keys")["coalescer"])
+
+
+class C3Test5ServidorProgresso(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_callback_de_progresso_com_ritmo_limitado(self):
+        """find_max_prime_sequential chama progress periodicamente, no máximo uma vez por intervalo."""
+        notificacoes = []
+        primo = find_max_prime_sequential(2, progress=notificacoes.append)
+        self.assertGreaterEqual(len(notificacoes), 2)
+        self.assertLessEqual(len(notificacoes), 2 / calculo.INTERVALO_PROGRESSO + 1)
+        self.assertLessEqual(notificacoes[-1]["best"], primo)
+        self.assertGreater(notificacoes[-1]["scanned"], notificacoes[0]["scanned"])
+
+    def test_progress_nao_aparece_em_list_functions(self):
+        """O parâmetro progress é interno ao servidor e não é anunciado aos clientes."""
+        funcoes = {f["name"]: f["args"] for f in servidor_rpc.list_functions()}
+        self.assertEqual(funcoes["crack_key"], ["n", "e", "timeout", "resume", "n_workers"])
+
+    def test_notificacoes_pelo_websocket_antes_do_resultado(self):
+        """Um cliente com on_progress recebe notificações e depois o resultado final."""
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                cliente = RPCClientWS(f"ws://localhost:{porta}")
+                notificacoes = []
+                resultado = await cliente.invoke("find_max_prime_sequential", [2], on_progress=notificacoes.append)
+                return resultado, notificacoes
+
+        resultado, notificacoes = asyncio.run(cenario())
+        self.assertTrue(is_prime(resultado))
+        self.assertGreaterEqual(len(notificacoes), 2)
+        self.assertTrue(all("best" in n for n in notificacoes))
+
+
+class C3Test6ServidorCancelamento(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_crack_key_para_quando_cancelado(self):
+        """crack_key termina pouco depois de o evento cancel ser sinalizado e guarda o checkpoint."""
+        public_key, _ = generate_keys(64)
+        n, e = public_key
+        cancel = threading.Event()
+        threading.Timer(0.5, cancel.set).start()
+        inicio = time.perf_counter()
+        with self.assertRaises(InterruptedError):
+            crack_key(n, e, timeout=30, cancel=cancel)
+        self.assertLess(time.perf_counter() - inicio, 3)
+        self.assertIsNotNone(CHECKPOINTS.obter(n))
+        CHECKPOINTS.remover(n)
+
+    def test_find_max_prime_parallel_para_quando_cancelado(self):
+        """find_max_prime_parallel devolve o melhor primo até ao momento quando é cancelado."""
+        cancel = threading.Event()
+        threading.Timer(0.5, cancel.set).start()
+        inicio = time.perf_counter()
+        primo = find_max_prime_parallel(30, 2, cancel=cancel)
+        self.assertLess(time.perf_counter() - inicio, 3)
+        self.assertGreaterEqual(primo, 2)
+
+    def _servidor(self, cenario):
+        async def correr():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                return await cenario(f"ws://localhost:{porta}")
+        return asyncio.run(correr())
+
+    def test_cancel_request(self):
+        """$/cancelRequest interrompe o pedido indicado, que responde com o erro -32800."""
+        public_key, _ = generate_keys(64)
+        n, e = public_key
+
+        async def cenario(uri):
+            async with websockets.connect(uri) as ws:
+                await ws.send(json.dumps({"jsonrpc": "2.0", "method": "crack_key", "params": [n, e, 30], "id": 1}))
+                await asyncio.sleep(0.5)
+                await ws.send(json.dumps({"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": 1}, "id": 2}))
+                respostas = [json.loads(await ws.recv()) for _ in range(2)]
+                return {r["id"]: r for r in respostas}
+
+        inicio = time.perf_counter()
+        respostas = self._servidor(cenario)
+        self.assertLess(time.perf_counter() - inicio, 5)
+        self.assertTrue(respostas[2]["result"])
+        self.assertEqual(respostas[1]["error"]["code"], -32800)
+        CHECKPOINTS.remover(n)
+
+    def test_desligar_cancela_trabalhos(self):
+        """Quando o cliente se desliga, o evento cancel dos seus pedidos é sinalizado."""
+        sinais = []
+
+        def lento(timeout, n_workers=4, *, progress=None, cancel=None):
+            sinais.append(cancel.wait(timeout))
+
+        async def cenario(uri):
+            async with websockets.connect(uri) as ws:
+                await ws.send(json.dumps({"jsonrpc": "2.0", "method": "find_max_prime_parallel", "params": [30], "id": 1}))
+                await asyncio.sleep(0.3)
+            for _ in range(50):
+                if sinais:
+                    break
+                await asyncio.sleep(0.1)
+
+        with mock.patch.dict(servidor_rpc.FUNCOES, {"find_max_prime_parallel": lento}):
+            self._servidor(cenario)
+        self.assertEqual(sinais, [True])
+
+
+class C3Test7ServidorAdmissao(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_leves_passam_a_frente_das_pesadas(self):
+        """Quando os slots ficam livres, a fila "leve" é servida antes da "pesada"."""
+        controlo = admissao.ControloAdmissao(2, {"leve": 4, "pesada": 4})
+        ordem = []
+
+        async def pedido(classe, nome, custo):
+            async with controlo.reservar(classe, custo):
+                ordem.append(nome)
+                await asyncio.sleep(0.05)
+
+        async def cenario():
+            ocupante = asyncio.create_task(pedido("pesada", "ocupante", 2))
+            await asyncio.sleep(0.01)
+            pesado = asyncio.create_task(pedido("pesada", "pesado", 2))
+            await asyncio.sleep(0.01)
+            leve = asyncio.create_task(pedido("leve", "leve", 1))
+            await asyncio.gather(ocupante, pesado, leve)
+
+        asyncio.run(cenario())
+        self.assertEqual(ordem, ["ocupante", "leve", "pesado"])
+        self.assertEqual(controlo.livres, 2)
+
+    def test_fila_cheia_recusa_logo(self):
+        """Com os slots ocupados e a fila cheia, o pedido é recusado com ServidorOcupado."""
+        controlo = admissao.ControloAdmissao(1, {"leve": 1, "pesada": 0})
+
+        async def cenario():
+            async with controlo.reservar("leve", 1):
+                with self.assertRaises(admissao.ServidorOcupado):
+                    async with controlo.reservar("pesada", 1):
+                        pass
+
+        asyncio.run(cenario())
+
+    def test_servidor_responde_server_busy(self):
+        """Um pedido pesado sem lugar na fila recebe logo o erro -32000."""
+        controlo = admissao.ControloAdmissao(1, {"leve": 1, "pesada": 0})
+
+        async def cenario():
+            async with controlo.reservar("leve", 1):
+                pedido = {"jsonrpc": "2.0", "method": "find_max_prime_sequential", "params": [5], "id": 7}
+                return await servidor_rpc.processar_pedido(pedido)
+
+        with mock.patch.object(servidor_rpc, "ADMISSAO", controlo):
+            inicio = time.perf_counter()
+            resposta = asyncio.run(cenario())
+        self.assertLess(time.perf_counter() - inicio, 1)
+        self.assertEqual(resposta["error"], {"code": -32000, "message": "Server busy"})
+
+    def test_limite_por_ligacao(self):
+        """Uma ligação com MAX_PEDIDOS_POR_LIGACAO pedidos em execução não pode lançar mais."""
+        ligacao = servidor_rpc.Ligacao(websocket=None)
+        ligacao.em_execucao = servidor_rpc.MAX_PEDIDOS_POR_LIGACAO
+        pedido = {"jsonrpc": "2.0", "method": "next_prime", "params": [10], "id": 1}
+        resposta = asyncio.run(servidor_rpc.processar_pedido(pedido, ligacao))
+        self.assertEqual(resposta["error"]["code"], -32000)
+
+    def test_slots_so_voltam_quando_a_execucao_acaba(self):
+        """Cancelar o pedido não devolve os slots enquanto a chamada continuar a correr no executor."""
+        controlo = admissao.ControloAdmissao(2, servidor_rpc.MAX_FILA)
+
+        def lento(timeout, n_workers=None, **_):
+            time.sleep(0.5)  # ignora o cancel, como uma chamada já iniciada no pool de processos
+            return 0
+
+        async def cenario():
+            tarefa = asyncio.ensure_future(servidor_rpc.executar("find_max_prime_parallel", [5, 2]))
+            await asyncio.sleep(0.1)
+            tarefa.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await tarefa
+            ocupados_apos_cancelar = controlo.estatisticas()["slots_in_use"]
+            await asyncio.sleep(0.6)
+            return ocupados_apos_cancelar, controlo.estatisticas()["slots_in_use"]
+
+        with mock.patch.object(servidor_rpc, "ADMISSAO", controlo), \
+                mock.patch.dict(servidor_rpc.FUNCOES, {"find_max_prime_parallel": lento}):
+            self.assertEqual(asyncio.run(cenario()), (2, 0))
+
+    def test_workers_limitados_aos_slots_reservados(self):
+        """Um pedido com mais workers do que os slots do servidor corre só com os workers que cabem nos slots."""
+        controlo = admissao.ControloAdmissao(2, servidor_rpc.MAX_FILA)
+        recebidos = []
+
+        def registar(timeout, n_workers=4, **_):
+            recebidos.append(n_workers)
+            return 0
+
+        with mock.patch.object(servidor_rpc, "ADMISSAO", controlo), \
+                mock.patch.dict(servidor_rpc.FUNCOES, {"find_max_prime_parallel": registar}):
+            for params in ([1, 8], {"timeout": 1, "n_workers": None}, [1, 1]):
+                asyncio.run(servidor_rpc.executar("find_max_prime_parallel", params))
+        self.assertEqual(recebidos, [2, min(autotune.melhor_n_workers(1), 2), 1])
+
+    def test_custo_segue_n_workers(self):
+        """find_max_prime_parallel ocupa tantos slots como workers pedidos."""
+        self.assertEqual(servidor_rpc.custo_pedido("find_max_prime_parallel", [5, 8]), 8)
+        self.assertEqual(servidor_rpc.custo_pedido("find_max_prime_parallel", {"timeout": 5}), 4)
+        self.assertEqual(servidor_rpc.custo_pedido("next_prime", [5]), 1)
+
+
+class C3Test8ServidorTrabalhos(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(servidor_rpc, "TRABALHOS", trabalhos.TabelaTrabalhos())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    async def _chamar(self, method, params, ligacao=None):
+        pedido = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        return await servidor_rpc.processar_pedido(pedido, ligacao)
+
+    async def _esperar_fim(self, job_id):
+        while True:
+            estado = (await self._chamar("job_status", [job_id]))["result"]
+            if estado["state"] in trabalhos.ESTADOS_FINAIS:
+                return estado
+            await asyncio.sleep(0.05)
+
+    def test_submit_poll_e_resultado(self):
+        """submit devolve um job_id cujo resultado se obtém com job_result depois de terminar."""
+        async def cenario():
+            job_id = (await self._chamar("submit", {"method": "next_prime", "params": [100]}))["result"]
+            estado = await self._esperar_fim(job_id)
+            return estado, await self._chamar("job_result", [job_id])
+
+        estado, resposta = asyncio.run(cenario())
+        self.assertEqual((estado["state"], estado["method"]), ("done", "next_prime"))
+        self.assertEqual(resposta["result"], 101)
+
+    def test_resultado_antes_do_fim_e_trabalho_desconhecido(self):
+        """job_result de um trabalho a correr dá -32002 e de um id inexistente dá -32001."""
+        async def cenario():
+            job_id = (await self._chamar("submit", ["find_max_prime_parallel", [1]]))["result"]
+            cedo = await self._chamar("job_result", [job_id])
+            desconhecido = await self._chamar("job_status", ["nao-existe"])
+            await self._esperar_fim(job_id)
+            return cedo, desconhecido
+
+        lento = lambda timeout, n_workers=4, *, progress=None, cancel=None: time.sleep(timeout) or 3
+        with mock.patch.dict(servidor_rpc.FUNCOES, {"find_max_prime_parallel": lento}):
+            cedo, desconhecido = asyncio.run(cenario())
+        self.assertEqual(cedo["error"]["code"], -32002)
+        self.assertEqual(desconhecido["error"]["code"], -32001)
+
+    def test_erro_do_trabalho(self):
+        """Um trabalho que falha fica em "error" e job_result devolve a mensagem de erro."""
+        async def cenario():
+            job_id = (await self._chamar("submit", ["crack_key", [-15, 3]]))["result"]
+            await self._esperar_fim(job_id)
+            return await self._chamar("job_result", [job_id])
+
+        resposta = asyncio.run(cenario())
+        self.assertIn("n deve ser um inteiro maior que 1", resposta["error"]["message"])
+
+    def test_subscribe_recebe_notificacao(self):
+        """Uma ligação subscrita recebe job_finished com o resultado, mesmo sem fazer poll."""
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                async with websockets.connect(f"ws://localhost:{porta}") as ws:
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "method": "submit",
+                                              "params": ["prime_factors", [360]], "id": 1}))
+                    job_id = json.loads(await ws.recv())["result"]
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "method": "subscribe", "params": [job_id], "id": 2}))
+                    mensagens = [json.loads(await ws.recv()) for _ in range(2)]
+                    return job_id, mensagens
+
+        job_id, mensagens = asyncio.run(cenario())
+        notificacao = next(m for m in mensagens if m.get("method") == "job_finished")
+        self.assertEqual(notificacao["params"]["job_id"], job_id)
+        self.assertEqual(notificacao["params"]["result"], [2, 2, 2, 3, 3, 5])
+
+    def test_subscricao_de_ligacao_fechada_e_retirada(self):
+        """Quando a ligação subscrita fecha, a subscrição sai da tabela e o fim do trabalho não lhe envia nada."""
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                job_id = servidor_rpc.TRABALHOS.criar("next_prime", [100])
+                async with websockets.connect(f"ws://localhost:{porta}") as ws:
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "method": "subscribe", "params": [job_id], "id": 1}))
+                    self.assertTrue(json.loads(await ws.recv())["result"])
+                    self.assertEqual(len(servidor_rpc.TRABALHOS._subscritores[job_id]), 1)
+                for _ in range(100):
+                    if job_id not in servidor_rpc.TRABALHOS._subscritores:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertNotIn(job_id, servidor_rpc.TRABALHOS._subscritores)
+                servidor_rpc.TRABALHOS.concluir(job_id, 101)
+
+        asyncio.run(cenario())
+
+    def test_notificacao_para_ligacao_fechada_e_descartada(self):
+        """Enviar uma notificação por uma ligação que já fechou não lança exceções."""
+        websocket = mock.Mock(subprotocol=None)
+        websocket.send = mock.AsyncMock(side_effect=websockets.ConnectionClosed(None, None))
+        asyncio.run(servidor_rpc.Ligacao(websocket).notificar({"jsonrpc": "2.0", "method": "job_finished"}))
+        websocket.send.assert_awaited_once()
+
+    def test_tabela_limitada_e_persistida(self):
+        """A tabela descarta os terminados mais antigos e recupera-os de ficheiro ao reabrir."""
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, "trabalhos.json")
+            tabela = trabalhos.TabelaTrabalhos(max_trabalhos=2, caminho=caminho)
+            primeiro = tabela.criar("next_prime", [1])
+            tabela.concluir(primeiro, 2)
+            segundo = tabela.criar("next_prime", [2])
+            tabela.concluir(segundo, 3)
+            terceiro = tabela.criar("next_prime", [3])
+            with self.assertRaises(trabalhos.TrabalhoDesconhecido):
+                tabela.estado(primeiro)
+            self.assertEqual(trabalhos.TabelaTrabalhos(caminho=caminho).resultado(segundo), 3)
+            tabela.criar("next_prime", [4])
+            with self.assertRaises(trabalhos.TabelaCheia):
+                tabela.criar("next_prime", [5])
+            self.assertEqual(tabela.estado(terceiro)["state"], "queued")
+
+
+class C3Test9ServidorMetricas(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(servidor_rpc, "METRICAS", metricas.Metricas())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def _chamar(self, method, params):
+        pedido = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        return asyncio.run(servidor_rpc.processar_pedido(pedido))
+
+    def test_percentis_do_histograma(self):
+        """Os percentis caem no bucket certo e nunca passam do máximo observado."""
+        histograma = metricas.Histograma()
+        for _ in range(98):
+            histograma.registar(0.001)
+        histograma.registar(0.5)
+        histograma.registar(2.0)
+        resumo = histograma.resumo()
+        self.assertLessEqual(resumo["p50"], 0.0016)
+        self.assertGreaterEqual(resumo["p50"], 0.001)
+        self.assertGreaterEqual(resumo["p99"], 0.5)
+        self.assertEqual(resumo["max"], 2.0)
+        self.assertEqual(resumo["count"], 100)
+
+    def test_server_stats_conta_pedidos_e_erros(self):
+        """server_stats tem contagens e latências por método, e agrupa métodos inexistentes."""
+        self._chamar("next_prime", [10])
+        self._chamar("next_prime", ["x"])
+        self._chamar("metodo_que_nao_existe", [])
+        stats = self._chamar("server_stats", [])["result"]
+        self.assertEqual(stats["methods"]["next_prime"]["requests"], 2)
+        self.assertEqual(stats["methods"]["next_prime"]["errors"], 1)
+        self.assertEqual(stats["methods"]["<invalid>"]["errors"], 1)
+        self.assertGreater(stats["methods"]["next_prime"]["latency"]["p99"], 0)
+        self.assertEqual(stats["in_flight"], 1)  # o próprio server_stats
+        self.assertIn("hit_rate", stats["cache"])
+        self.assertIn("utilisation", stats["pools"]["process"])
+
+    def test_endpoint_prometheus(self):
+        """O endpoint HTTP devolve as métricas no formato de texto do Prometheus."""
+        self._chamar("is_prime", [7])
+
+        async def cenario():
+            servidor = await asyncio.start_server(servidor_rpc.servir_metricas, "localhost", 0)
+            porta = servidor.sockets[0].getsockname()[1]
+            async with servidor:
+                reader, writer = await asyncio.open_connection("localhost", porta)
+                writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+                resposta = await reader.read()
+                writer.close()
+                return resposta.decode()
+
+        texto = asyncio.run(cenario())
+        self.assertTrue(texto.startswith("HTTP/1.0 200 OK"))
+        self.assertIn('rpc_requests_total{method="is_prime"} 1', texto)
+        self.assertIn('rpc_request_duration_seconds_bucket{method="is_prime",le="+Inf"} 1', texto)
+        self.assertIn('rpc_queued{class="pesada"} 0', texto)
+
+    def test_porta_de_metricas_ocupada_nao_impede_o_arranque(self):
+        """Se a porta das métricas já estiver em uso, o servidor RPC arranca na mesma (sem métricas)."""
+        async def cenario():
+            with socket.socket() as ocupada:
+                ocupada.bind(("localhost", 0))
+                ocupada.listen()
+                servidor = asyncio.ensure_future(servidor_rpc.main("localhost", 0, ocupada.getsockname()[1]))
+                await asyncio.sleep(0.5)
+                a_correr = not servidor.done()
+                servidor.cancel()
+                await asyncio.gather(servidor, return_exceptions=True)
+                return a_correr
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(asyncio.run(cenario()))
+
+
+class C3Test10ServidorMultiProcesso(unittest.TestCase):
+
+    def _lancar(self):
+        """Arranca servidor_rpc.py com dois workers numa porta livre; devolve (processo, porta)."""
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            porta = s.getsockname()[1]
+        pasta = os.path.dirname(os.path.abspath(servidor_rpc.__file__))
+        processo = subprocess.Popen([sys.executable, "servidor_rpc.py", "--workers", "2", "--port", str(porta),
+                                     "--metrics-port", "0"], cwd=pasta,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return processo, porta
+
+    async def _ligacoes_por_worker(self, porta):
+        """Abre ligações até ter uma em cada worker; devolve {pid: websocket}."""
+        ligacoes = {}
+        limite = time.monotonic() + 30
+        while len(ligacoes) < 2 and time.monotonic() < limite:
+            try:
+                ws = await websockets.connect(f"ws://localhost:{porta}")
+            except OSError:
+                await asyncio.sleep(0.2)  # os workers ainda estão a arrancar
+                continue
+            await ws.send(json.dumps({"jsonrpc": "2.0", "method": "server_stats", "id": 0}))
+            pid = json.loads(await ws.recv())["result"]["pid"]
+            if pid in ligacoes:
+                await ws.close()
+            else:
+                ligacoes[pid] = ws
+        return ligacoes
+
+    @unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT não disponível")
+    def test_workers_partilham_porta_e_param_com_sigterm(self):
+        """Com --workers 2, as ligações são servidas por dois processos e SIGTERM pára o conjunto."""
+        processo, porta = self._lancar()
+
+        async def cenario():
+            ligacoes = await self._ligacoes_por_worker(porta)
+            for ws in ligacoes.values():
+                await ws.close()
+            return set(ligacoes)
+
+        try:
+            pids = asyncio.run(cenario())
+            self.assertEqual(len(pids), 2)
+            self.assertNotIn(processo.pid, pids)
+        finally:
+            processo.send_signal(signal.SIGTERM)
+            codigo = processo.wait(timeout=20)
+        self.assertEqual(codigo, 0)
+
+    @unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT não disponível")
+    def test_trabalho_submetido_num_worker_e_visto_noutro(self):
+        """Um trabalho submetido num worker é consultado e subscrito a partir de outro worker."""
+        processo, porta = self._lancar()
+
+        async def chamar(ws, method, params, id_):
+            await ws.send(json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": id_}))
+            mensagens = []
+            while not any(m.get("id") == id_ for m in mensagens):
+                mensagens.append(json.loads(await ws.recv()))
+            return mensagens
+
+        async def cenario():
+            ligacoes = await self._ligacoes_por_worker(porta)
+            self.assertEqual(len(ligacoes), 2)
+            a, b = ligacoes.values()
+            try:
+                [submetido] = await chamar(a, "submit", {"method": "find_max_prime_sequential", "params": [1]}, 1)
+                job_id = submetido["result"]
+                [estado] = await chamar(b, "job_status", [job_id], 2)
+                mensagens = await chamar(b, "subscribe", [job_id], 3)
+                while not any(m.get("method") == "job_finished" for m in mensagens):
+                    mensagens.append(json.loads(await asyncio.wait_for(b.recv(), 10)))
+                [resultado] = await chamar(b, "job_result", [job_id], 4)
+            finally:
+                await a.close()
+                await b.close()
+            [notificacao] = [m for m in mensagens if m.get("method") == "job_finished"]
+            return job_id, estado, notificacao, resultado
+
+        try:
+            job_id, estado, notificacao, resultado = asyncio.run(cenario())
+        finally:
+            processo.send_signal(signal.SIGTERM)
+            processo.wait(timeout=20)
+        self.assertEqual(estado["result"]["job_id"], job_id)
+        self.assertEqual(notificacao["params"]["job_id"], job_id)
+        self.assertTrue(is_prime(resultado["result"]))
+        self.assertEqual(notificacao["params"]["result"], resultado["result"])
+
+
+class C3Test11ProtocoloBinario(unittest.TestCase):
+
+    def test_codificacao_ida_e_volta(self):
+        """Todos os tipos JSON (e inteiros muito grandes, positivos e negativos) sobrevivem à codificação."""
+        grande = 3 ** 20000
+        mensagem = {"jsonrpc": "2.0", "id": 7, "result": [None, True, False, 0, -1, 255, 2.5, "ção",
+                                                          grande, -grande, {"a": [1, {}]}, []]}
+        frame = protocolo_binario.codificar(mensagem)
+        self.assertEqual(protocolo_binario.descodificar(frame), mensagem)
+        self.assertLess(len(frame), grande.bit_length() * math.log10(2))  # bytes, não dígitos decimais
+        with self.assertRaises(protocolo_binario.ErroProtocolo):
+            protocolo_binario.descodificar(frame[:-1])
+
+    def test_negociacao_binaria_e_recurso_a_json(self):
+        """O servidor fala binário com quem o negociar e JSON com os clientes antigos, na mesma porta."""
+        grande = 7 ** 6000  # mais dígitos do que o limite de conversão int/str do Python
+
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0,
+                                        select_subprotocol=servidor_rpc.escolher_subprotocolo) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                uri = f"ws://localhost:{porta}"
+                async with websockets.connect(uri, subprotocols=[protocolo_binario.SUBPROTOCOLO]) as ws:
+                    self.assertEqual(ws.subprotocol, protocolo_binario.SUBPROTOCOLO)
+                    await ws.send(protocolo_binario.codificar(
+                        {"jsonrpc": "2.0", "method": "mdc", "params": [grande, grande], "id": 1}))
+                    binaria = await ws.recv()
+                    await ws.send(b"\x01Z")
+                    invalida = protocolo_binario.descodificar(await ws.recv())
+                async with websockets.connect(uri) as ws:
+                    self.assertIsNone(ws.subprotocol)
+                    await ws.send(json.dumps({"jsonrpc": "2.0", "method": "mdc", "params": [12, 18], "id": 2}))
+                    texto = json.loads(await ws.recv())
+                via_cliente = await RPCClientWS(uri).invoke("mdc", [grande, grande])
+                return binaria, invalida, texto, via_cliente
+
+        binaria, invalida, texto, via_cliente = asyncio.run(cenario())
+        self.assertIsInstance(binaria, bytes)
+        self.assertEqual(protocolo_binario.descodificar(binaria)["result"], grande)
+        self.assertEqual(invalida["error"]["code"], -32700)
+        self.assertEqual(texto["result"], 6)
+        self.assertEqual(via_cliente, grande)
+
+    def test_cache_com_inteiros_acima_do_limite_de_conversao(self):
+        """Os métodos em cache aceitam e devolvem inteiros com mais de 4300 dígitos (sem passar por str(int))."""
+        patcher = mock.patch.object(servidor_rpc, "CACHE", cache_rpc.CacheResultados())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(servidor_rpc.encerrar_executores)
+        pedido = {"jsonrpc": "2.0", "method": "prime_factors", "params": [2 ** 20000], "id": 1}
+        for _ in range(2):
+            resposta = asyncio.run(servidor_rpc.processar_pedido(pedido))
+            self.assertEqual(resposta["result"], [2] * 20000)
+        resposta = asyncio.run(servidor_rpc.processar_pedido(
+            {"jsonrpc": "2.0", "method": "is_prime", "params": [10 ** 5000], "id": 2}))
+        self.assertFalse(resposta["result"])
+        stats = servidor_rpc.CACHE.estatisticas()
+        self.assertEqual((stats["hits"], stats["entries"]), (1, 2))
+
+
+class C3Test12ClientePersistente(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_chamadas_concorrentes_partilham_uma_ligacao_e_religam(self):
+        """Várias chamadas em simultâneo usam uma só ligação; se esta cair, a seguinte volta a ligar."""
+        ligacoes = []
+
+        async def tratar(websocket):
+            ligacoes.append(websocket)
+            await servidor_rpc.tratar_cliente(websocket)
+
+        async def cenario():
+            async with websockets.serve(tratar, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                async with RPCClientWS(f"ws://localhost:{porta}") as cliente:
+                    valores = list(range(2, 60))
+                    resultados = await asyncio.gather(*(cliente.invoke("is_prime", [n]) for n in valores))
+                    abertas = len(ligacoes)
+                    demorada = asyncio.ensure_future(cliente.invoke("find_max_prime_sequential", [5]))
+                    await asyncio.sleep(0.3)
+                    await ligacoes[0].close()
+                    with self.assertRaises(ConnectionError):
+                        await demorada
+                    depois = await cliente.invoke("mdc", [12, 18])
+                return valores, resultados, abertas, depois, len(ligacoes)
+
+        valores, resultados, abertas, depois, total = asyncio.run(cenario())
+        self.assertEqual(resultados, [is_prime(n) for n in valores])
+        self.assertEqual(abertas, 1)
+        self.assertEqual(depois, 6)
+        self.assertEqual(total, 2)
+
+    def test_parar_de_ouvir_o_progresso_liberta_o_servidor(self):
+        """Cancelar um invoke com on_progress envia $/cancelRequest e o servidor pára o cálculo."""
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                porta = servidor.sockets[0].getsockname()[1]
+                async with RPCClientWS(f"ws://localhost:{porta}") as cliente:
+                    primeiro = asyncio.get_running_loop().create_future()
+
+                    def on_progress(dados):
+                        if not primeiro.done():
+                            primeiro.set_result(dados)
+
+                    inicio = time.perf_counter()
+                    chamada = asyncio.ensure_future(cliente.invoke("find_max_prime_sequential", [30], on_progress))
+                    await primeiro
+                    chamada.cancel()
+                    with self.assertRaises(asyncio.CancelledError):
+                        await chamada
+                    while (await cliente.invoke("server_stats"))["cpu_slots"]["in_use"] > 0:
+                        await asyncio.sleep(0.1)
+                    return time.perf_counter() - inicio
+
+        self.assertLess(asyncio.run(cenario()), 5)
+
+    def test_ligacao_fechada_pelo_servidor_enquanto_parado(self):
+        """Se o servidor fechou a ligação enquanto o cliente estava bloqueado, a chamada seguinte vai numa nova."""
+        ligacoes, pronto, fechar = [], threading.Event(), threading.Event()
+        porta = []
+
+        async def registar(websocket):
+            ligacoes.append(websocket)
+            await servidor_rpc.tratar_cliente(websocket)
+
+        async def servidor():
+            async with websockets.serve(registar, "localhost", 0) as s:
+                porta.append(s.sockets[0].getsockname()[1])
+                pronto.set()
+                await asyncio.to_thread(fechar.wait)
+                await ligacoes[0].close()
+                await asyncio.sleep(2)
+
+        fio = threading.Thread(target=asyncio.run, args=(servidor(),), daemon=True)
+        fio.start()
+        pronto.wait(10)
+
+        async def cenario():
+            async with RPCClientWS(f"ws://localhost:{porta[0]}") as cliente:
+                antes = await cliente.invoke("mdc", [12, 18])
+                fechar.set()
+                time.sleep(0.5)  # bloqueia o event loop (como um input() síncrono)
+                return antes, await cliente.invoke("mdc", [10, 4])
+
+        with mock.patch.object(RPCClientWS, "INATIVIDADE_VERIFICACAO", 0.2):
+            self.assertEqual(asyncio.run(cenario()), (6, 2))
+        self.assertEqual(len(ligacoes), 2)
+        fio.join(5)
+
+    def test_invoke_many_usa_batches_e_devolve_pela_ordem(self):
+        """invoke_many agrupa as chamadas em poucos batches e devolve resultados ou exceções pela ordem."""
+        mensagens = []
+        original = servidor_rpc.tratar_mensagem
+
+        async def contar(ligacao, message):
+            mensagens.append(message)
+            await original(ligacao, message)
+
+        async def cenario():
+            with mock.patch.object(servidor_rpc, "tratar_mensagem", contar):
+                async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                    porta = servidor.sockets[0].getsockname()[1]
+                    async with RPCClientWS(f"ws://localhost:{porta}") as cliente:
+                        chamadas = [("is_prime", [n]) for n in range(1000, 1240)]
+                        chamadas[7] = ("nao_existe", [])
+                        return chamadas, await cliente.invoke_many(chamadas, max_batch=50)
+
+        chamadas, resultados = asyncio.run(cenario())
+        self.assertEqual(len(mensagens), 5)
+        self.assertEqual(len(resultados), len(chamadas))
+        self.assertIsInstance(resultados[7], Exception)
+        self.assertIn("-32601", str(resultados[7]))
+        for i, (_, params) in enumerate(chamadas):
+            if i != 7:
+                self.assertEqual(resultados[i], is_prime(params[0]))
+
+
+class C3Test13Coordenador(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_largest_prime_in_range(self):
+        """Devolve o maior primo do intervalo semiaberto, None se não houver, e respeita o tempo limite."""
+        self.assertEqual(calculo.largest_prime_in_range(0, 10), 7)
+        self.assertEqual(calculo.largest_prime_in_range(10, 12), 11)
+        self.assertIsNone(calculo.largest_prime_in_range(24, 29))
+        self.assertEqual(calculo.largest_prime_in_range(10**6, 10**6 + 20_000), previous_prime(10**6 + 20_000))
+        with self.assertRaises(TimeoutError):
+            calculo.largest_prime_in_range(0, 10**30, timeout=0)
+
+    def test_timeout_fora_da_chave_da_cache(self):
+        """Leases iguais com timeouts diferentes (o tempo que resta ao coordenador) partilham a entrada da cache."""
+        self.assertEqual(servidor_rpc.chave_cache("largest_prime_in_range", [10, 20, 3.7]),
+                         servidor_rpc.chave_cache("largest_prime_in_range", {"lo": 10, "hi": 20, "timeout": 9.1}))
+        self.assertNotEqual(servidor_rpc.chave_cache("largest_prime_in_range", [10, 20]),
+                            servidor_rpc.chave_cache("largest_prime_in_range", [10, 30]))
+
+    def test_leases_de_um_no_morto_sao_reemitidos(self):
+        """Com um nó que cai a cada pedido, os seus leases passam para os outros e o resultado é o exato."""
+        async def no_morto(websocket):
+            await websocket.recv()
+            await websocket.close()
+
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as a, \
+                    websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as b, \
+                    websockets.serve(no_morto, "localhost", 0) as morto:
+                uris = [f"ws://localhost:{s.sockets[0].getsockname()[1]}" for s in (a, b, morto)]
+                c = coordenador.Coordenador(uris, tamanho_lease=1_000)
+                return uris, await c.procurar_maior_primo(60, inicio=10**6, fim=10**6 + 20_000)
+
+        uris, resultado = asyncio.run(cenario())
+        self.assertEqual(resultado["best"], previous_prime(10**6 + 20_000))
+        self.assertTrue(resultado["complete"])
+        self.assertEqual(resultado["leases"], 20)
+        self.assertEqual(resultado["scanned_up_to"], 10**6 + 20_000)
+        self.assertFalse(resultado["nodes"][uris[2]]["alive"])
+        self.assertEqual(resultado["nodes"][uris[2]]["leases"], 0)
+        self.assertEqual(resultado["nodes"][uris[0]]["leases"] + resultado["nodes"][uris[1]]["leases"], 20)
+
+
+class C3Test14GeradorCarga(unittest.TestCase):
+
+    def tearDown(self):
+        servidor_rpc.encerrar_executores()
+
+    def test_distribuicoes_dos_parametros(self):
+        """Cada parâmetro da mistura é fixo ou tirado da sua distribuição (uniform inteira ou real, choice)."""
+        rng = random.Random(0)
+        for _ in range(100):
+            params = gerador_carga.gerar_params({"n": {"uniform": [10, 20]}, "x": {"uniform": [0.5, 1.0]},
+                                                 "k": {"choice": ["a", "b"]}, "fixo": 7}, rng)
+            self.assertTrue(10 <= params["n"] <= 20 and isinstance(params["n"], int))
+            self.assertTrue(0.5 <= params["x"] <= 1.0)
+            self.assertIn(params["k"], ("a", "b"))
+            self.assertEqual(params["fixo"], 7)
+        self.assertEqual(gerador_carga.gerar_params([{"choice": [3]}, 4], rng), [3, 4])
+
+    def test_percentis_exatos(self):
+        """Os percentis vêm das latências medidas, não de buckets (que os arredondariam até 2x)."""
+        estatisticas = gerador_carga._Estatisticas()
+        for i in range(1, 101):
+            estatisticas.registar(i / 1000, None if i % 10 else ValueError())
+        resumo = estatisticas.resumo(2.0)
+        latencia = resumo["latency"]
+        self.assertEqual((latencia["p50"], latencia["p95"], latencia["p99"], latencia["max"]), (0.05, 0.095, 0.099, 0.1))
+        self.assertAlmostEqual(latencia["mean"], 0.0505)
+        self.assertEqual((resumo["requests"], resumo["errors"], resumo["requests_per_sec"]), (100, 10, 50.0))
+        self.assertEqual(resumo["error_types"], {"ValueError": 10})
+
+    def test_relatorio_por_metodo_nos_dois_modos(self):
+        """Conta pedidos e erros por método, com latências, em closed-loop e em open-loop a taxa fixa."""
+        mistura = [{"method": "is_prime", "weight": 3, "params": {"n": {"uniform": [2, 10**6]}}},
+                   {"method": "metodo_inexistente", "weight": 1}]
+
+        async def cenario():
+            async with websockets.serve(servidor_rpc.tratar_cliente, "localhost", 0) as servidor:
+                uri = f"ws://localhost:{servidor.sockets[0].getsockname()[1]}"
+                gerador = gerador_carga.GeradorCarga(uri, mistura, ligacoes=2, rampa=0.2, seed=1)
+                fechado = await gerador.correr(1, "closed", concorrencia=4)
+                aberto = await gerador.correr(1, "open", taxa=50)
+                return fechado, aberto
+
+        fechado, aberto = asyncio.run(cenario())
+        self.assertEqual(fechado["connections"], 2)
+        primos, falhados = fechado["methods"]["is_prime"], fechado["methods"]["metodo_inexistente"]
+        self.assertGreater(primos["requests"], 0)
+        self.assertEqual(primos["errors"], 0)
+        self.assertEqual(falhados["error_rate"], 1.0)
+        self.assertEqual(fechado["total"]["requests"], primos["requests"] + falhados["requests"])
+        self.assertLessEqual(primos["latency"]["p50"], primos["latency"]["p99"])
+        self.assertLessEqual(primos["latency"]["p99"], primos["latency"]["max"])
+        self.assertEqual(aberto["total"]["requests"], 50)
+        with self.assertRaises(ValueError):
+            asyncio.run(gerador_carga.GeradorCarga().correr(1, "open"))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,219 @@
+## Tabela de trabalhos assíncronos do servidor RPC (submit / job_status / job_result / subscribe)
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+ESTADOS_FINAIS = ("done", "error")
+
+
+class TrabalhoDesconhecido(Exception):
+    """Não existe (ou já expirou) nenhum trabalho com o id indicado."""
+
+
+class TrabalhoPorTerminar(Exception):
+    """O trabalho ainda não terminou, por isso ainda não tem resultado."""
+
+
+class TabelaCheia(Exception):
+    """A tabela já tem o número máximo de trabalhos por terminar."""
+
+
+class TabelaTrabalhos:
+    """
+    Guarda o estado dos trabalhos submetidos ao servidor. A tabela tem um número máximo de trabalhos;
+    os terminados são mantidos durante retencao segundos (ou até precisarem de dar lugar a novos).
+    Se for indicado um caminho, os trabalhos terminados são persistidos num ficheiro JSON e
+    voltam a estar disponíveis depois de o servidor reiniciar.
+    """
+
+    def __init__(self, max_trabalhos: int = 1000, retencao: float = 3600.0, caminho: Optional[str] = None):
+        self.max_trabalhos = max_trabalhos
+        self.retencao = retencao
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._trabalhos: Dict[str, dict] = {}
+        self._subscritores: Dict[str, list] = {}
+        if caminho is not None and os.path.exists(caminho):
+            with open(caminho, "r", encoding="utf-8") as f:
+                self._trabalhos = json.load(f)
+
+    def criar(self, method: str, params: Any) -> str:
+        """Regista um novo trabalho e devolve o seu id. Lança TabelaCheia se não houver lugar."""
+        with self._lock:
+            self._limpar_expirados()
+            if len(self._trabalhos) >= self.max_trabalhos:
+                terminados = [t for t in self._trabalhos.values() if t["state"] in ESTADOS_FINAIS]
+                if not terminados:
+                    raise TabelaCheia("demasiados trabalhos por terminar")
+                del self._trabalhos[min(terminados, key=lambda t: t["finished"])["job_id"]]
+            job_id = uuid.uuid4().hex
+            self._trabalhos[job_id] = {
+                "job_id": job_id,
+                "method": method,
+                "params": params,
+                "state": "queued",
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+            }
+            return job_id
+
+    def iniciar(self, job_id: str):
+        with self._lock:
+            trabalho = self._trabalhos[job_id]
+            trabalho["state"] = "running"
+            trabalho["started"] = time.time()
+
+    def concluir(self, job_id: str, resultado: Any = None, erro: Optional[str] = None):
+        """Marca o trabalho como terminado (com resultado ou com erro) e avisa os subscritores."""
+        with self._lock:
+            trabalho = self._trabalhos.get(job_id)
+            if trabalho is None:
+                return
+            trabalho["state"] = "error" if erro is not None else "done"
+            trabalho["finished"] = time.time()
+            if erro is not None:
+                trabalho["error"] = erro
+            else:
+                trabalho["result"] = resultado
+            self._persistir()
+            subscritores = self._subscritores.pop(job_id, [])
+            final = dict(trabalho)
+        for callback in subscritores:
+            callback(final)
+
+    def obter(self, job_id: str) -> dict:
+        """Cópia do trabalho, com o resultado ou o erro se já tiver terminado."""
+        with self._lock:
+            self._limpar_expirados()
+            trabalho = self._trabalhos.get(job_id)
+            if trabalho is None:
+                raise TrabalhoDesconhecido(job_id)
+            return dict(trabalho)
+
+    def estado(self, job_id: str) -> dict:
+        """Estado do trabalho, sem o resultado."""
+        return _sem_resultado(self.obter(job_id))
+
+    def resultado(self, job_id: str) -> Any:
+        """Resultado do trabalho. Lança TrabalhoPorTerminar se ainda estiver a correr e RuntimeError se falhou."""
+        return _resultado(self.obter(job_id))
+
+    def subscrever(self, job_id: str, callback: Callable[[dict], None]):
+        """Chama callback(trabalho) quando o trabalho terminar (ou já, se já tiver terminado)."""
+        with self._lock:
+            trabalho = self._trabalhos.get(job_id)
+            if trabalho is None:
+                raise TrabalhoDesconhecido(job_id)
+            if trabalho["state"] not in ESTADOS_FINAIS:
+                self._subscritores.setdefault(job_id, []).append(callback)
+                return
+            final = dict(trabalho)
+        callback(final)
+
+    def cancelar_subscricao(self, job_id: str, callback: Callable[[dict], None]):
+        """Retira um callback registado com subscrever (ex: a ligação que o pediu fechou)."""
+        with self._lock:
+            subscritores = self._subscritores.get(job_id)
+            if subscritores is not None and callback in subscritores:
+                subscritores.remove(callback)
+                if not subscritores:
+                    del self._subscritores[job_id]
+
+    def _limpar_expirados(self):
+        limite = time.time() - self.retencao
+        expirados = [job_id for job_id, t in self._trabalhos.items()
+                     if t["state"] in ESTADOS_FINAIS and t["finished"] < limite]
+        for job_id in expirados:
+            del self._trabalhos[job_id]
+
+    def _persistir(self):
+        if self.caminho is None:
+            return
+        terminados = {job_id: t for job_id, t in self._trabalhos.items() if t["state"] in ESTADOS_FINAIS}
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(terminados, f)
+        os.replace(temporario, self.caminho)
+
+
+class TabelaRemota:
+    """
+    Tabela de trabalhos de outro processo (um proxy de TabelaTrabalhos, ver estado_partilhado), usada
+    pelos workers do modo multi-processo para todos verem os mesmos trabalhos. As subscrições ficam
+    neste processo, porque os callbacks não passam entre processos: os trabalhos que terminam noutro
+    worker só são notados por verificar_subscricoes, que o servidor chama periodicamente.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._lock = threading.Lock()
+        self._subscritores: Dict[str, list] = {}
+
+    def criar(self, method: str, params: Any) -> str:
+        return self._proxy.criar(method, params)
+
+    def iniciar(self, job_id: str):
+        self._proxy.iniciar(job_id)
+
+    def concluir(self, job_id: str, resultado: Any = None, erro: Optional[str] = None):
+        self._proxy.concluir(job_id, resultado, erro)
+        self.verificar_subscricoes([job_id])
+
+    def obter(self, job_id: str) -> dict:
+        return self._proxy.obter(job_id)
+
+    def estado(self, job_id: str) -> dict:
+        return _sem_resultado(self.obter(job_id))
+
+    def resultado(self, job_id: str) -> Any:
+        return _resultado(self.obter(job_id))
+
+    def subscrever(self, job_id: str, callback: Callable[[dict], None]):
+        trabalho = self.obter(job_id)
+        if trabalho["state"] in ESTADOS_FINAIS:
+            callback(trabalho)
+            return
+        with self._lock:
+            self._subscritores.setdefault(job_id, []).append(callback)
+
+    def cancelar_subscricao(self, job_id: str, callback: Callable[[dict], None]):
+        with self._lock:
+            subscritores = self._subscritores.get(job_id)
+            if subscritores is not None and callback in subscritores:
+                subscritores.remove(callback)
+                if not subscritores:
+                    del self._subscritores[job_id]
+
+    def verificar_subscricoes(self, job_ids=None):
+        """Chama os callbacks dos trabalhos subscritos (todos, ou os de job_ids) que já terminaram."""
+        with self._lock:
+            job_ids = [job_id for job_id in (job_ids if job_ids is not None else list(self._subscritores))
+                       if job_id in self._subscritores]
+        for job_id in job_ids:
+            try:
+                trabalho = self.obter(job_id)
+            except TrabalhoDesconhecido:
+                trabalho = None  # expirou entretanto: já não há nada para notificar
+            if trabalho is not None and trabalho["state"] not in ESTADOS_FINAIS:
+                continue
+            with self._lock:
+                subscritores = self._subscritores.pop(job_id, [])
+            if trabalho is not None:
+                for callback in subscritores:
+                    callback(trabalho)
+
+
+def _sem_resultado(trabalho: dict) -> dict:
+    return {k: v for k, v in trabalho.items() if k not in ("params", "result", "error")}
+
+
+def _resultado(trabalho: dict) -> Any:
+    if trabalho["state"] == "error":
+        raise RuntimeError(trabalho["error"])
+    if trabalho["state"] != "done":
+        raise TrabalhoPorTerminar(f"trabalho {trabalho['job_id']} ainda está em '{trabalho['state']}'")
+    return trabalho["result"]